@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Usage: the same as main.py, but updates are handled on an asyncio loop, with
+chats handled in parallel. See pipeline.py for details.
+Press Ctrl-C on the command line or send SIGTERM to the process to stop the
+bot.
+"""
+
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import asyncio
+import signal
+import logging
+from main import HelpText, make_pipeline
+from pipeline import AsyncPipeline
+from snapshot import MessageSnapshot
+from telegram import Bot, Update # type: ignore
+from telegram.error import TelegramError # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait for updates in one long poll request
+PollTimeout = 10
+
+Commands = { "/start": "Hi!"
+           , "/help": HelpText
+           }
+
+
+def dispatch(update : Update, pipeline : AsyncPipeline) -> None:
+    "Answer a command or queue a message for its chat worker"
+    message = update.message
+    if message is None or not message.text:
+        return
+    if message.text.startswith("/"):
+        command = message.text.split()[0].split("@")[0]
+        if command in Commands:
+            loop = asyncio.get_event_loop()
+            loop.run_in_executor(pipeline.executor, partial(
+                    pipeline.pipeline.api.send_message
+                    ,chat_id = message.chat.id
+                    ,text    = Commands[command]
+                    ))
+        return
+    pipeline.feed(MessageSnapshot.of(message))
+
+
+async def poll(bot : Bot, pipeline : AsyncPipeline, stop : asyncio.Event) -> None:
+    "Long poll for updates until stopped"
+    loop = asyncio.get_event_loop()
+    # a thread of its own, so that sends can't starve polling
+    poller = ThreadPoolExecutor(1)
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await loop.run_in_executor(poller, partial(
+                    bot.get_updates, offset=offset, timeout=PollTimeout))
+        except TelegramError as e:
+            logger.warning("Polling failed: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            dispatch(update, pipeline)
+    poller.shutdown()
+
+
+async def run(token : str) -> None:
+    bot = Bot(token)
+    sync_pipeline, stop_pipeline = make_pipeline(bot)
+    pipeline = AsyncPipeline(sync_pipeline)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await poll(bot, pipeline, stop)
+
+    await pipeline.drain()
+    await pipeline.close()
+    stop_pipeline()
+
+
+if __name__ == '__main__':
+    with open("token.txt", "r") as tfile:
+        token = tfile.read().strip()
+    asyncio.run(run(token))
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: what content keys cost per message, and how many distinct keys
+a wave of slightly changed spam gets with each way of keying: the raw text,
+the hash of the normalised text, and near duplicates.
+
+Run with `python3 -m bench.content_bench [messages]`
+"""
+
+from typing import *
+from timeit import default_timer as timer
+import random
+import sys
+
+from content import content_key, NearDuplicates
+
+
+Spam = "Buy cheap followers for your channel at example dot com, best prices today"
+
+def wave(count : int, rand : random.Random) -> List[str]:
+    "Copies of the spam, each with a word shouted and a number added"
+    result = []
+    for i in range(count):
+        words = Spam.split()
+        j = rand.randrange(len(words))
+        words[j] = words[j].upper() + rand.choice(["!", "!!", "", "."])
+        result.append(" ".join(words) + f" {rand.randrange(1000)}")
+    return result
+
+def chatter(count : int, rand : random.Random) -> List[str]:
+    words = ["a", "word", "some", "text", "here", "lol", "ok", "why", "yes", "🙂"]
+    return [" ".join(rand.choice(words) for _ in range(rand.randint(1, 12)))
+            for _ in range(count)]
+
+
+def measure(name : str, texts : List[str], key : Callable[[str], Hashable]) -> None:
+    start = timer()
+    keys = [key(text) for text in texts]
+    elapsed = timer() - start
+    print(f"{name:>12}: {elapsed / len(texts) * 1e6:6.2f} us per text, {len(set(keys))} keys")
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rand = random.Random(0)
+    for title, texts in [("spam wave", wave(count, rand)), ("chatter", chatter(count, rand))]:
+        print(f"{title}, {count} texts")
+        content_key.cache_clear()
+        measure("raw", texts, lambda text: text)
+        measure("normalised", texts, content_key)
+        near = NearDuplicates()
+        measure("near", texts, lambda text: near.key(-1, text))
+
+
+if __name__ == '__main__':
+    main()
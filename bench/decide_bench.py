@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: the counter chain of MessageCounter against the single pass of
+FusedMessageCounter, on synthetic traffic (see traffic.py) where a share of
+messages are replies. Every run starts with empty tables. Note that the fused
+counter does more work: it updates all windows for every message, while the
+chain stops at the first counter that acts.
+
+Run with `python3 -m bench.decide_bench [updates]`
+"""
+
+from typing import *
+from collections import Counter
+from timeit import default_timer as timer
+import random
+import sys
+
+import logic
+from snapshot import MessageSnapshot
+from bench.traffic import synthetic_updates
+
+
+def chain() -> logic.MessageCounter:
+    return logic.MessageCounter([ logic.UserMessageCounter({})
+                                , logic.ContentMessageCounter({})
+                                , logic.ReplyMessageCounter({})
+                                ])
+
+def fused() -> logic.MessageCounter:
+    return logic.FusedMessageCounter( logic.UserMessageCounter({})
+                                    , logic.ContentMessageCounter({})
+                                    , logic.ReplyMessageCounter({})
+                                    )
+
+
+def with_replies(messages : List[MessageSnapshot], share : float) -> None:
+    "Make a share of messages replies to a few recent messages of their chat"
+    rand = random.Random(0)
+    recent: Dict[int, List[int]] = {}
+    for msg in messages:
+        targets = recent.setdefault(msg.chat_id, [])
+        if targets and rand.random() < share:
+            msg.reply_to_id = rand.choice(targets)
+        targets.append(msg.message_id)
+        del targets[:-3]
+
+
+def run(counter : logic.MessageCounter, messages : List[MessageSnapshot]
+       ) -> Tuple[float, Counter]:
+    actions: Counter = Counter()
+    start = timer()
+    for msg in messages:
+        actions[type(counter.decide(msg)).__name__] += 1
+    return timer() - start, actions
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    messages = [MessageSnapshot.from_json(u["message"])
+                for u in synthetic_updates(count, chats=50, users=200)]
+    with_replies(messages, 0.2)
+
+    print(f"{count} messages")
+    for name, make in [("chain", chain), ("fused", fused)]:
+        # the best of a few runs
+        elapsed, actions = min(run(make(), messages) for _ in range(3))
+        print(f"{name:>6}: {elapsed / count * 1e6:6.2f} us per decision"
+              f", {count / elapsed:8.0f} decisions/s, {dict(actions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: how long it takes to save and restore the state of a bot that
+tracks a lot of keys. Every user has posted a couple of messages, and every
+hundredth is flooding.
+
+Run with `python3 -m bench.persist_bench [keys]`
+"""
+
+from typing import *
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+import os
+import sys
+import tempfile
+
+import logic
+import join
+import persist
+from snapshot import MessageSnapshot, UserRef
+
+
+def populate(keys : int, now : datetime
+            ) -> Tuple[logic.MessageCounter, join.Joiner]:
+    counter = logic.MessageCounter()
+    counter.counters = [logic.UserMessageCounter({}), logic.ContentMessageCounter({})]
+    joiner = join.Joiner()
+    users = counter.counters[0]
+
+    for i in range(keys):
+        user = UserRef(i, f"user {i}", f"https://t.me/user{i}")
+        messages = [MessageSnapshot(-1000 - i % 500, i * 10 + j, user
+                                   ,now + timedelta(seconds=j), f"message {j}")
+                    for j in range(2)]
+        status = logic.StatusLax(messages[0])
+        status.queue.insert(messages[1])
+        if i % 100 == 0:
+            status = logic.StatusStrict(now + logic.DelayRelease)
+            key = join.UID(messages[0].chat_id, i)
+            joiner.user_bases[key] = join.MessageInfo(i, join.TextBuffer(
+                    ["<i>says:</i>"] + [m.text for m in messages]))
+        users.msg_queue[logic.UID(messages[0].chat_id, i)] = status
+    return counter, joiner
+
+
+def main() -> None:
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    now = datetime.utcnow()
+    counter, joiner = populate(keys, now)
+    handle, path = tempfile.mkstemp()
+    os.close(handle)
+    try:
+        start = timer()
+        persist.dump_state(counter, joiner, path)
+        dumped = timer() - start
+        size = os.path.getsize(path)
+
+        counter, joiner = populate(0, now)
+        start = timer()
+        # as if restarted right away, however long the snapshot took
+        restored = persist.load_state(counter, joiner, path, now)
+        loaded = timer() - start
+    finally:
+        os.remove(path)
+
+    print(f"{keys} keys, {size / 1024 / 1024:.1f} MiB, {size / keys:.0f} bytes per key")
+    print(f"snapshot: {dumped:.2f} s")
+    print(f"restore:  {loaded:.2f} s, {restored} statuses")
+
+
+if __name__ == '__main__':
+    main()
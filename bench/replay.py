@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: replay an update stream through the counter and the joiner, the
+way the pipeline runs them, against a fake bot. Updates come from a file
+with one bot api update json per line, like ones recorded from a webhook, or
+are made up by traffic.py.
+
+Reports decisions per second, p50 and p99 time to handle one message, peak
+memory of the process and how many api calls the bot would make. Every edit
+and deletion is counted as a call of its own, as if there was no coalescing
+or batching.
+
+With --save the results are written to a json file, and with --baseline
+they're compared to such a file: replay fails if decisions per second
+dropped, or api calls grew, by more than --tolerance.
+
+Run with `python3 -m bench.replay [--input updates.jsonl] [--updates N]`
+"""
+
+from typing import *
+from collections import Counter
+from timeit import default_timer as timer
+import argparse
+import json
+import resource
+import sys
+
+import join
+import logic
+import store
+from pipeline import Pipeline
+from snapshot import MessageSnapshot
+from test.fakebot import FakeBot
+from bench.traffic import synthetic_updates
+
+
+class CountingBot(FakeBot):
+    "Only counts calls, a long replay would keep too many of them"
+    def request(self, method : str, *args) -> None:
+        self.counts[method] += 1
+
+class ImmediateEditor:
+    def __init__(self, bot) -> None:
+        self.bot = bot
+    def edit(self, action : join.EditMessage) -> None:
+        self.bot.edit_message_text(action.text, action.chat_id, action.message_id)
+
+class ImmediateDeleter:
+    def __init__(self, bot) -> None:
+        self.bot = bot
+    def delete(self, chat_id : int, message_id : int) -> None:
+        self.bot.delete_message(chat_id, message_id)
+
+
+def read_updates(path : str) -> Iterator[dict]:
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def make_counter(kind : str) -> logic.MessageCounter:
+    if kind == "chain":
+        return logic.MessageCounter([ logic.UserMessageCounter({})
+                                    , logic.ContentMessageCounter({})
+                                    , logic.ReplyMessageCounter({})
+                                    ])
+    return store.make_counter(store.MemoryStore())
+
+
+def percentile(values : List[float], p : float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def replay(messages : List[MessageSnapshot], counter_kind : str) -> dict:
+    bot = CountingBot()
+    pipeline = Pipeline( make_counter(counter_kind), store.make_joiner(store.MemoryStore())
+                       , bot, ImmediateEditor(bot), ImmediateDeleter(bot))
+    actions: Counter = Counter()
+    latencies = []
+    handle = pipeline.handle
+    start = timer()
+    for msg in messages:
+        began = timer()
+        handle(msg)
+        latencies.append(timer() - began)
+    elapsed = timer() - start
+
+    return { "messages": len(messages)
+           , "decisions_per_second": len(messages) / elapsed
+           , "p50_us": percentile(latencies, 0.5) * 1e6
+           , "p99_us": percentile(latencies, 0.99) * 1e6
+           # kilobytes on linux
+           , "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+           , "api_calls": sum(bot.counts.values())
+           , "calls_by_method": dict(bot.counts)
+           , "live_entries": pipeline.counter.live_entries()
+           }
+
+
+def compare(result : dict, baseline : dict, tolerance : float) -> List[str]:
+    "Regressions of result against the baseline"
+    problems = []
+    if result["decisions_per_second"] < baseline["decisions_per_second"] * (1 - tolerance):
+        problems.append(f"decisions/s dropped from {baseline['decisions_per_second']:.0f}"
+                        f" to {result['decisions_per_second']:.0f}")
+    if result["api_calls"] > baseline["api_calls"] * (1 + tolerance):
+        problems.append(f"api calls grew from {baseline['api_calls']} to {result['api_calls']}")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay updates through counter and joiner")
+    parser.add_argument("--input", help="file with one update json per line")
+    parser.add_argument("--record", help="write the synthetic updates to this file")
+    parser.add_argument("--updates", type=int, default=100000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--flood-share", type=float, default=0.3)
+    parser.add_argument("--wave-share", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--counter", choices=["fused", "chain"], default="fused")
+    parser.add_argument("--save", help="write results to this json file")
+    parser.add_argument("--baseline", help="compare results to this json file")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.input is not None:
+        updates: Iterable[dict] = read_updates(args.input)
+    else:
+        updates = synthetic_updates(args.updates, chats=args.chats, users=args.users
+                                   ,flood_share=args.flood_share
+                                   ,wave_share=args.wave_share, seed=args.seed)
+    if args.record is not None:
+        updates = list(updates)
+        with open(args.record, "w") as f:
+            for update in updates:
+                f.write(json.dumps(update) + "\n")
+    messages = [MessageSnapshot.from_json(u["message"])
+                for u in updates if "message" in u]
+
+    result = replay(messages, args.counter)
+    print(f"{result['messages']} messages, {result['decisions_per_second']:.0f} decisions/s")
+    print(f"per message p50: {result['p50_us']:.1f} us, p99: {result['p99_us']:.1f} us")
+    print(f"peak rss: {result['peak_rss_mb']:.1f} MiB")
+    print(f"api calls: {result['api_calls']} {result['calls_by_method']}")
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            problems = compare(result, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f"regression: {problem}")
+        if problems:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
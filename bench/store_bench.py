@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: decisions per second with counters and joiner kept in each state
+store, on synthetic traffic (see traffic.py). The sqlite store is measured
+with a few batch sizes, batch 1 being a commit on every change.
+
+Run with `python3 -m bench.store_bench [updates]`
+"""
+
+from typing import *
+from timeit import default_timer as timer
+import os
+import sys
+import tempfile
+
+import logic
+import join
+import store
+from snapshot import MessageSnapshot
+from test.fakebot import FakeBot
+from bench.traffic import synthetic_updates
+
+
+def decide_all(state : store.StateStore, messages : List[MessageSnapshot]) -> float:
+    "Run messages through counter and joiner, return the time it took"
+    counter = store.make_counter(state)
+    joiner = store.make_joiner(state)
+    bot = FakeBot()
+    start = timer()
+    for msg in messages:
+        decision = counter.decide(msg)
+        if isinstance(decision, logic.DoNothing):
+            joiner.cleanup(msg)
+            continue
+        elif isinstance(decision, logic.UniteMessagesContent):
+            action = joiner.unite_content(decision.messages)
+        elif isinstance(decision, logic.JoinUserMessages):
+            action = joiner.join(decision.messages)
+        else:
+            continue
+        if isinstance(action, join.SendMessage):
+            joiner.sent_message(msg, bot.send_message(msg.chat_id, action.text))
+    state.close()
+    return timer() - start
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    messages = [MessageSnapshot.from_json(u["message"])
+                for u in synthetic_updates(count, chats=50, users=200)]
+
+    def report(name : str, elapsed : float) -> None:
+        print(f"{name:>16}: {count / elapsed:8.0f} decisions/s")
+
+    report("memory", decide_all(store.MemoryStore(), messages))
+    for batch in (1, 100, 1000):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "state.db")
+        try:
+            report(f"sqlite batch {batch}", decide_all(store.SqliteStore(path, batch=batch), messages))
+        finally:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            os.rmdir(directory)
+
+
+if __name__ == '__main__':
+    main()
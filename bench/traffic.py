@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: synthetic update streams for benchmarks. Updates are dicts in
+the bot api json format, the same telegram posts to a webhook. Most messages
+are ordinary chatter, some users flood bursts of messages, and sometimes many
+users post the same text.
+"""
+
+from typing import *
+import itertools
+import random
+import time
+
+
+def make_update(update_id : int, message_id : int, chat_id : int
+               ,user_id : int, date : float, text : str
+               ) -> dict:
+    return { "update_id": update_id
+           , "message": { "message_id": message_id
+                        , "date": int(date)
+                        , "chat": {"id": chat_id, "type": "supergroup"}
+                        , "from": { "id": user_id
+                                  , "is_bot": False
+                                  , "first_name": f"User{user_id}"
+                                  , "username": f"user{user_id}"
+                                  }
+                        , "text": text
+                        }
+           }
+
+
+def synthetic_updates(count : int
+                     ,chats : int = 10
+                     ,users : int = 100
+                     ,flood_share : float = 0.3
+                     ,wave_share : float = 0.05
+                     ,rate : float = 50.0
+                     ,start : Optional[float] = None
+                     ,seed : int = 0
+                     ) -> Iterator[dict]:
+    """
+    `count` updates over `chats` chats with `users` users each, arriving at
+    `rate` messages per second of message time. `flood_share` of messages
+    are parts of floods, `wave_share` are parts of copy-paste waves.
+    """
+    rand = random.Random(seed)
+    date = time.time() - count / rate if start is None else start
+    update_ids = itertools.count(1)
+    message_ids: Dict[int, Iterator[int]] = {}
+    produced = 0
+
+    def message(chat_id : int, user_id : int, text : str) -> dict:
+        if chat_id not in message_ids:
+            message_ids[chat_id] = itertools.count(1)
+        return make_update(next(update_ids), next(message_ids[chat_id])
+                          ,chat_id, user_id, date, text)
+
+    while produced < count:
+        chat_id = -1000 - rand.randrange(chats)
+        roll = rand.random()
+        if roll < flood_share:
+            # one user posts a burst of short messages
+            user_id = rand.randrange(users) + 1
+            burst = rand.randint(5, 15)
+            for i in range(burst):
+                yield message(chat_id, user_id, rand.choice(["lol", "what", "no", "why"]) + "!" * i)
+                date += rand.uniform(0.2, 1.0)
+            produced += burst
+        elif roll < flood_share + wave_share:
+            # many users post the same text
+            text = rand.choice(["+", "first", "F", "ok"])
+            wave = rand.randint(5, 30)
+            for _ in range(wave):
+                yield message(chat_id, rand.randrange(users) + 1, text)
+                date += rand.uniform(0.05, 0.5)
+            produced += wave
+        else:
+            text = " ".join(rand.choice(["a", "word", "some", "text", "here"])
+                            for _ in range(rand.randint(1, 20)))
+            yield message(chat_id, rand.randrange(users) + 1, text)
+            produced += 1
+        date += rand.expovariate(rate)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: load generator for the webhook server. Posts synthetic flood
+traffic (see traffic.py) over a few keep-alive connections, all messages of
+one chat over the same connection so that their order is kept.
+
+By default it starts the webhook server in process with a fake bot, and
+measures both the http round trip and the end to end latency: from posting a
+flooded message to the fake bot deleting it. With --url it loads an already
+running server and only the http round trip is measured.
+
+Run with `python3 -m bench.webhook_load [--updates N] [--url URL]`
+"""
+
+from typing import *
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import json
+import time
+
+import logic
+import join
+from deleter import DeletionQueue
+from editor import EditCoalescer
+from pipeline import Pipeline, AsyncPipeline
+from webhook import WebhookServer
+from test.fakebot import FakeBot
+from bench.traffic import synthetic_updates
+
+
+class TimingBot(FakeBot):
+    "Remembers when each message was deleted"
+    def __init__(self) -> None:
+        super().__init__()
+        self.deleted_at: Dict[Tuple[int, int], float] = {}
+
+    def delete_message(self, chat_id : int, message_id : int) -> None:
+        self.deleted_at[(chat_id, message_id)] = time.monotonic()
+        super().delete_message(chat_id, message_id)
+
+
+def percentile(values : List[float], p : float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def post_all(host : str, port : int, path : str
+                  ,updates : List[dict]
+                  ,posted_at : Dict[Tuple[int, int], float]
+                  ) -> List[float]:
+    "Post updates over one connection, return round trip times"
+    reader, writer = await asyncio.open_connection(host, port)
+    round_trips = []
+    for update in updates:
+        body = json.dumps(update).encode()
+        message = update["message"]
+        start = time.monotonic()
+        posted_at[(message["chat"]["id"], message["message_id"])] = start
+        writer.write(b"POST " + path.encode() + b" HTTP/1.1\r\n"
+                     b"Host: " + host.encode() + b"\r\n"
+                     b"Content-Type: application/json\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n"
+                     + body)
+        await writer.drain()
+        status = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b""):
+            pass
+        round_trips.append(time.monotonic() - start)
+        if b" 200 " not in status:
+            raise RuntimeError(f"Server answered {status!r}")
+    writer.close()
+    return round_trips
+
+
+async def load(host : str, port : int, path : str
+              ,updates : List[dict], connections : int
+              ) -> Tuple[List[float], Dict[Tuple[int, int], float], float]:
+    shards: List[List[dict]] = [[] for _ in range(connections)]
+    for update in updates:
+        shards[hash(update["message"]["chat"]["id"]) % connections].append(update)
+    posted_at: Dict[Tuple[int, int], float] = {}
+    start = time.monotonic()
+    results = await asyncio.gather(*(post_all(host, port, path, shard, posted_at)
+                                     for shard in shards if shard))
+    elapsed = time.monotonic() - start
+    return [t for r in results for t in r], posted_at, elapsed
+
+
+async def in_process(updates : List[dict], connections : int) -> None:
+    bot = TimingBot()
+    deleter = DeletionQueue(bot, window=0)
+    editor = EditCoalescer(bot)
+    pipeline = AsyncPipeline(Pipeline(logic.MessageCounter(), join.Joiner()
+                                     , bot, editor, deleter))
+    server = WebhookServer(pipeline, "/hook")
+    await server.start("127.0.0.1", 0)
+    assert server.server is not None
+    port = server.server.sockets[0].getsockname()[1]
+
+    round_trips, posted_at, elapsed = await load("127.0.0.1", port, "/hook"
+                                                ,updates, connections)
+    await pipeline.drain()
+    await server.stop()
+    await pipeline.close()
+    editor.stop()
+    deleter.stop()
+
+    end_to_end = [bot.deleted_at[key] - posted_at[key]
+                  for key in bot.deleted_at if key in posted_at]
+    report(len(updates), elapsed, round_trips)
+    print(f"flooded messages deleted: {len(end_to_end)}")
+    print(f"post to delete p50: {percentile(end_to_end, 0.5) * 1000:.2f} ms"
+          f", p99: {percentile(end_to_end, 0.99) * 1000:.2f} ms")
+    print(f"bot api calls: {dict(bot.counts)}")
+
+
+def report(count : int, elapsed : float, round_trips : List[float]) -> None:
+    print(f"{count} updates in {elapsed:.2f} s, {count / elapsed:.0f} updates/s")
+    print(f"http round trip p50: {percentile(round_trips, 0.5) * 1000:.2f} ms"
+          f", p99: {percentile(round_trips, 0.99) * 1000:.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load the webhook server")
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--url", help="url of a running server to load")
+    args = parser.parse_args()
+
+    updates = list(synthetic_updates(args.updates, chats=args.chats))
+    if args.url is None:
+        asyncio.run(in_process(updates, args.connections))
+    else:
+        url = urlparse(args.url)
+        round_trips, _, elapsed = asyncio.run(load(
+                url.hostname, url.port or 80, url.path or "/", updates, args.connections))
+        report(len(updates), elapsed, round_trips)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: compare the ring window with SortedCollection on a workload like
+the one StatusLax puts on it: bursts of messages with nearly monotonic dates,
+every insert followed by dropping messages older than a delay.
+
+Run with `python3 -m bench.window_bench`
+"""
+
+from typing import *
+from datetime import datetime, timedelta
+from timeit import timeit
+import random
+
+from sortedcollection import SortedCollection
+from window import RingWindow
+
+class Dated:
+    __slots__ = ("date",)
+    def __init__(self, date : datetime) -> None:
+        self.date = date
+
+
+def bursty_traffic(count : int, disorder : float) -> List[Dated]:
+    "Bursts of quick messages with pauses, some arriving out of order"
+    now = datetime.utcnow()
+    result = []
+    while len(result) < count:
+        for _ in range(random.randint(1, 20)):
+            now += timedelta(milliseconds=random.randint(50, 800))
+            date = now
+            if random.random() < disorder:
+                date -= timedelta(seconds=random.randint(1, 3))
+            result.append(Dated(date))
+        now += timedelta(seconds=random.randint(5, 60))
+    return result[:count]
+
+
+def run_sorted(traffic : List[Dated], delay : timedelta, capacity : int) -> None:
+    queue = SortedCollection([], lambda x: x.date)
+    for item in traffic:
+        queue.insert(item)
+        threshold = queue[-1].date - delay
+        while len(queue) > 0 and queue[0].date <= threshold:
+            queue.drop_index(0)
+        while len(queue) > capacity:
+            queue.drop_index(0)
+        max(map(lambda x: x.date, queue))
+
+def run_ring(traffic : List[Dated], delay : timedelta, capacity : int) -> None:
+    queue = RingWindow(capacity)
+    for item in traffic:
+        queue.insert(item)
+        queue.drop_until(queue.latest() - delay)
+        queue.latest()
+
+
+def main() -> None:
+    count = 100_000
+    print(f"{count} messages per run, seconds per run")
+    print(f"{'capacity':>8} {'delay':>6} {'disorder':>8} {'sorted':>8} {'ring':>8}")
+    for capacity, delay_s in [(5, 15), (50, 60), (500, 600)]:
+        delay = timedelta(seconds=delay_s)
+        for disorder in [0.0, 0.05]:
+            traffic = bursty_traffic(count, disorder)
+            t_sorted = timeit(lambda: run_sorted(traffic, delay, capacity), number=1)
+            t_ring = timeit(lambda: run_ring(traffic, delay, capacity), number=1)
+            print(f"{capacity:>8} {delay_s:>6} {disorder:>8} {t_sorted:>8.3f} {t_ring:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
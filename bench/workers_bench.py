@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: decisions per second of the worker pool with different amounts
+of workers, on synthetic traffic (see traffic.py) over many chats. Workers
+decide and join in memory, and nothing is sent anywhere, so this measures
+how deciding scales with processes. Time is counted from the first message
+fed to all workers being done.
+
+Run with `python3 -m bench.workers_bench [updates]`
+"""
+
+from typing import *
+from timeit import default_timer as timer
+import multiprocessing
+import sys
+
+import logic
+import join
+import store
+import workers
+from snapshot import MessageSnapshot
+from test.fakebot import FakeBot
+from bench.traffic import synthetic_updates
+
+
+def deciding_handler(index : int, count : int) -> workers.Handler:
+    state = store.MemoryStore()
+    counter = store.make_counter(state)
+    joiner = store.make_joiner(state)
+    bot = FakeBot()
+    def handle(msg : MessageSnapshot) -> None:
+        decision = counter.decide(msg)
+        if isinstance(decision, logic.DoNothing):
+            joiner.cleanup(msg)
+            return
+        elif isinstance(decision, logic.UniteMessagesContent):
+            action = joiner.unite_content(decision.messages)
+        elif isinstance(decision, logic.JoinUserMessages):
+            action = joiner.join(decision.messages)
+        else:
+            return
+        if isinstance(action, join.SendMessage):
+            joiner.sent_message(msg, bot.send_message(msg.chat_id, action.text))
+    return handle, lambda: None
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    messages = [MessageSnapshot.from_json(u["message"])
+                for u in synthetic_updates(count, chats=500, users=200)]
+    cores = multiprocessing.cpu_count()
+    print(f"{count} updates, {cores} cores")
+
+    amounts = sorted({1, 2, 4, cores})
+    for amount in amounts:
+        start = timer()
+        pool = workers.WorkerPool(amount, deciding_handler, batch=256)
+        for msg in messages:
+            pool.feed(msg)
+        pool.stop()
+        elapsed = timer() - start
+        print(f"{amount:>3} workers: {count / elapsed:8.0f} decisions/s")
+
+
+if __name__ == '__main__':
+    main()
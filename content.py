@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+from typing import *
+from collections import OrderedDict
+from functools import lru_cache
+from hashlib import blake2b
+import itertools
+import unicodedata
+import zlib
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: what counts as the same content. Texts are normalised: case is
+folded, and runs of whitespace and punctuation become one space, so "lol",
+"LOL" and "lol!!" are the same. Emoji and other symbols are kept. The key of
+a text is a 64-bit hash of the normalised form, so texts of any length take
+the same space, and the text itself isn't kept.
+
+Optionally, NearDuplicates also finds texts that differ in a few characters,
+like spam waves where every copy is changed a little. Texts are compared by
+MinHash signatures of their character shingles, and candidates are found by
+banding the signatures (locality sensitive hashing). A text that is close to
+a recent one gets the key of that one. This costs tens of microseconds per
+text, so it's off by default.
+"""
+
+
+def punctuation_table() -> Dict[int, str]:
+    "Maps punctuation and spaces to a space, for str.translate"
+    # blocks where nearly all of the punctuation people type lives: ascii,
+    # latin-1, general punctuation, cjk and fullwidth forms
+    blocks = [ range(0x0000, 0x0100)
+             , range(0x2000, 0x2070)
+             , range(0x3000, 0x3040)
+             , range(0xFE30, 0xFE70)
+             , range(0xFF00, 0xFF70)
+             ]
+    table = {}
+    for code in itertools.chain(*blocks):
+        char = chr(code)
+        if char.isspace() or unicodedata.category(char)[0] in "PZ":
+            table[code] = " "
+    return table
+
+PunctuationTable = punctuation_table()
+
+
+def normalize(text : str) -> str:
+    "Casefold and collapse whitespace and punctuation into single spaces"
+    normal = " ".join(text.casefold().translate(PunctuationTable).split())
+    # a text of only punctuation is its own content
+    return normal if normal else text.strip()
+
+
+def hash64(data : str) -> int:
+    "Stable across processes, unlike hash(). Signed, so that sqlite takes it"
+    digest = blake2b(data.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+# waves repeat the same texts, and those are looked up again and again
+@lru_cache(maxsize=1 << 12)
+def content_key(text : str) -> int:
+    return hash64(normalize(text))
+
+
+def key_of(message) -> Optional[int]:
+    "Content key of a message snapshot, computed by the counter if it was seen"
+    if message.content_key is not None:
+        return message.content_key
+    if message.text is None:
+        return None
+    return content_key(message.text)
+
+
+##### near duplicates #####
+
+
+# characters in a shingle
+ShingleSize = 4
+# marks a bin that no shingle fell into
+Empty = 1 << 32
+
+
+class NearDuplicates:
+    """
+    Remembers signatures of recent texts of each chat and gives a text the
+    key of an earlier text it's similar to. At most capacity texts are
+    remembered, the least recently matched are forgotten first.
+    """
+
+    def __init__(self, capacity : int = 10000
+                     , bands : int = 8
+                     , rows : int = 3
+                     , similarity : float = 0.6
+                ) -> None:
+        self.capacity = capacity
+        self.bands = bands
+        self.rows = rows
+        self.similarity = similarity
+        # (chat_id, key) -> signature, in order of use
+        self.signatures: OrderedDict = OrderedDict()
+        # (chat_id, band number, band of signature) -> key
+        self.buckets: Dict[Tuple[int, int, tuple], int] = {}
+
+    def signature(self, normal : str) -> Optional[List[int]]:
+        """
+        One permutation MinHash: every shingle is hashed once, the hash
+        picks a bin, and each bin keeps the smallest value that fell into it.
+        This costs one hash per shingle instead of one per shingle and bin.
+        """
+        if len(normal) < ShingleSize:
+            return None
+        data = normal.encode()
+        size = self.bands * self.rows
+        signature = [Empty] * size
+        for i in range(len(data) - ShingleSize + 1):
+            value, bin = divmod(zlib.crc32(data[i : i + ShingleSize]), size)
+            if value < signature[bin]:
+                signature[bin] = value
+        return signature
+
+    def band_keys(self, chat_id : int, signature : List[int]) -> List[Tuple[int, int, tuple]]:
+        rows = self.rows
+        keys = []
+        for i in range(self.bands):
+            band = tuple(signature[i * rows : (i + 1) * rows])
+            # short texts leave bins empty, and those would match anything
+            if Empty not in band:
+                keys.append((chat_id, i, band))
+        return keys
+
+    def key(self, chat_id : int, text : str) -> int:
+        normal = normalize(text)
+        signature = self.signature(normal)
+        if signature is None:
+            # too short to be similar to anything but itself
+            return hash64(normal)
+
+        band_keys = self.band_keys(chat_id, signature)
+        for band_key in band_keys:
+            key = self.buckets.get(band_key)
+            if key is None:
+                continue
+            other = self.signatures.get((chat_id, key))
+            if other is not None and self.close(signature, other):
+                self.signatures.move_to_end((chat_id, key))
+                return key
+
+        key = hash64(normal)
+        self.remember(chat_id, key, signature, band_keys)
+        return key
+
+    def close(self, a : List[int], b : List[int]) -> bool:
+        "Estimated jaccard similarity of the shingles is high enough"
+        same = 0
+        used = 0
+        for x, y in zip(a, b):
+            if x != Empty or y != Empty:
+                used += 1
+                same += x == y
+        return used > 0 and same >= self.similarity * used
+
+    def remember(self, chat_id : int, key : int, signature : List[int]
+                ,band_keys : List[Tuple[int, int, tuple]]
+                ) -> None:
+        self.signatures[(chat_id, key)] = signature
+        for band_key in band_keys:
+            self.buckets[band_key] = key
+        while len(self.signatures) > self.capacity:
+            (old_chat, old_key), old_signature = self.signatures.popitem(last=False)
+            for band_key in self.band_keys(old_chat, old_signature):
+                # the bucket may have been taken by a newer text since
+                if self.buckets.get(band_key) == old_key:
+                    del self.buckets[band_key]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import logging
+from telegram.error import BadRequest # type: ignore
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: deleting user messages off the update handler. When a user
+floods, the handler has several messages to delete at once, and then one more
+for every message after that. Instead of deleting them one by one right away,
+the handler puts them into a DeletionQueue. The queue waits a short window
+for more messages from the same chat, and then deletes all of them at once
+from a background thread.
+
+If the bot has the bulk `delete_messages` method (Bot API 7.0 and later), a
+batch costs one request per 100 messages. Otherwise the messages of a batch
+are deleted concurrently on a small thread pool.
+"""
+
+logger = logging.getLogger(__name__)
+
+# most messages deleteMessages accepts in one request
+BulkLimit = 100
+
+
+class DeletionQueue:
+    "Collects messages to delete per chat and deletes them in batches"
+
+    def __init__(self, bot, window : float = 0.5, workers : int = 8) -> None:
+        self.bot = bot
+        self.window = window
+        self.bulk = hasattr(bot, "delete_messages")
+        # chat_id -> message ids in insertion order, without duplicates
+        self.pending: Dict[int, Dict[int, None]] = {}
+        # chat_id -> when to flush. Window is the same for everyone, so
+        # insertion order is also the order of deadlines
+        self.deadlines: Dict[int, float] = {}
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.pool = ThreadPoolExecutor(workers)
+
+        # statistics
+        self.requests = 0
+        self.deleted = 0
+        self.failed = 0
+        self.stats_lock = threading.Lock()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def delete(self, chat_id : int, message_id : int) -> None:
+        "Schedule deletion of a message"
+        with self.cond:
+            if chat_id not in self.pending:
+                self.pending[chat_id] = {}
+                self.deadlines[chat_id] = time.monotonic() + self.window
+                self.cond.notify()
+            # deleting twice is harmless but costs a request
+            self.pending[chat_id][message_id] = None
+
+    def flush(self) -> None:
+        "Delete everything pending right now"
+        with self.cond:
+            batches = list(self.pending.items())
+            self.pending.clear()
+            self.deadlines.clear()
+        for chat_id, ids in batches:
+            self.send(chat_id, list(ids))
+
+    def stop(self) -> None:
+        "Flush what is pending and stop the background thread"
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+        self.flush()
+        self.pool.shutdown()
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+            self.send(*batch)
+
+    def next_batch(self) -> Optional[Tuple[int, List[int]]]:
+        "Wait until some chat's window is over and take its messages"
+        with self.cond:
+            while not self.stopped:
+                if not self.deadlines:
+                    self.cond.wait()
+                    continue
+                chat_id, deadline = next(iter(self.deadlines.items()))
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    self.cond.wait(timeout)
+                    continue
+                del self.deadlines[chat_id]
+                return chat_id, list(self.pending.pop(chat_id))
+            return None
+
+    def send(self, chat_id : int, ids : List[int]) -> None:
+        if self.bulk:
+            for i in range(0, len(ids), BulkLimit):
+                self.delete_bulk(chat_id, ids[i : i + BulkLimit])
+        else:
+            # wait for all of them so that batches of one chat don't overlap
+            list(self.pool.map(lambda m: self.delete_one(chat_id, m), ids))
+
+    def delete_bulk(self, chat_id : int, ids : List[int]) -> None:
+        try:
+            self.bot.delete_messages(chat_id, ids)
+            self.count(len(ids), 0)
+        except BadRequest as e:
+            # happens when none of the messages could be deleted
+            logger.info("Could not delete %s in %s: %s", ids, chat_id, e)
+            self.count(0, len(ids))
+
+    def delete_one(self, chat_id : int, message_id : int) -> None:
+        try:
+            self.bot.delete_message(chat_id, message_id)
+            self.count(1, 0)
+        except BadRequest:
+            # the message is already deleted by someone else
+            self.count(0, 1)
+
+    def count(self, deleted : int, failed : int) -> None:
+        with self.stats_lock:
+            self.requests += 1
+            self.deleted += deleted
+            self.failed += failed
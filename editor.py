@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+from typing import *
+import heapq
+import threading
+import time
+import logging
+from telegram.error import BadRequest # type: ignore
+import join
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: editing joined messages at a limited rate. In strict mode every
+message of a flooding user becomes an edit of the joined message, and
+telegram answers too frequent edits with flood-wait errors. An EditCoalescer
+sends at most one edit per message per interval. The first edit goes out
+right away, and the edits that come during the interval replace each other,
+so that only the latest text is sent when the interval is over.
+
+Edits are sent from a background thread.
+"""
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, message_id)
+EditKey = Tuple[int, int]
+
+
+class EditCoalescer:
+    "Sends at most one edit of a message per interval, always the latest one"
+
+    def __init__(self, bot, interval : float = 3.0) -> None:
+        self.bot = bot
+        self.interval = interval
+        # latest edit not yet sent for each message
+        self.pending: Dict[EditKey, join.EditMessage] = {}
+        # when each pending edit is due
+        self.queue: List[Tuple[float, EditKey]] = []
+        # when the last edit of a message was sent
+        self.last_sent: Dict[EditKey, float] = {}
+        self.cond = threading.Condition()
+        self.stopped = False
+
+        # statistics
+        self.requested = 0
+        self.sent = 0
+        self.saved = 0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def edit(self, action : join.EditMessage) -> None:
+        "Schedule an edit. Replaces an earlier edit of the same message"
+        key = (action.chat_id, action.message_id)
+        with self.cond:
+            self.requested += 1
+            if key in self.pending:
+                self.pending[key] = action
+                self.saved += 1
+                return
+            self.pending[key] = action
+            due = time.monotonic()
+            last = self.last_sent.get(key)
+            if last is not None:
+                due = max(due, last + self.interval)
+            heapq.heappush(self.queue, (due, key))
+            self.cond.notify()
+
+    def flush(self) -> None:
+        "Send all pending edits right now"
+        with self.cond:
+            actions = list(self.pending.values())
+            self.pending.clear()
+            self.queue.clear()
+        for action in actions:
+            self.send(action)
+
+    def stop(self) -> None:
+        "Send pending edits and stop the background thread"
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+        self.flush()
+
+    def run(self) -> None:
+        while True:
+            action = self.next_edit()
+            if action is None:
+                return
+            self.send(action)
+
+    def next_edit(self) -> Optional[join.EditMessage]:
+        with self.cond:
+            while not self.stopped:
+                if not self.queue:
+                    self.cond.wait()
+                    continue
+                due, key = self.queue[0]
+                now = time.monotonic()
+                if due > now:
+                    self.cond.wait(due - now)
+                    continue
+                heapq.heappop(self.queue)
+                self.forget_old(now)
+                self.last_sent[key] = now
+                return self.pending.pop(key)
+            return None
+
+    def forget_old(self, now : float) -> None:
+        "Drop send times that no longer delay anything"
+        if len(self.last_sent) < 1024:
+            return
+        self.last_sent = {k: t for k, t in self.last_sent.items()
+                               if now - t < self.interval}
+
+    def send(self, action : join.EditMessage) -> None:
+        with self.cond:
+            self.sent += 1
+        try:
+            self.bot.edit_message_text(
+                    chat_id     = action.chat_id
+                    ,message_id = action.message_id
+                    ,text       = action.text
+                    ,parse_mode = "HTML"
+                    ,disable_web_page_preview = True
+                    )
+        except BadRequest as e:
+            # most likely the text didn't change or the message is gone
+            logger.info("Edit of %s in %s failed: %s"
+                       , action.message_id, action.chat_id, e)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+from typing import *
+from datetime import datetime, timedelta
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: a timing wheel that evicts statuses from a counter table once
+they can no longer affect any decision.
+
+Every status knows its deadline: the moment after which a new message for the
+same key would be treated exactly as if the key was never seen. The counter
+schedules a key at its status deadline after each update, and advances the
+wheel with the time of each arriving message. The wheel has one slot per
+second, and is big enough so that any deadline fits in one turn. Each
+scheduled entry is looked at once, so the cost is amortized O(1) per message.
+
+Entries are never removed when a status is updated, instead a stale entry is
+checked against the current deadline of a status and skipped.
+"""
+
+
+def to_tick(time : datetime) -> int:
+    return int(time.timestamp())
+
+
+class ExpiryWheel:
+    "Evicts statuses with passed deadlines from a table"
+
+    def __init__(self, table : MutableMapping, horizon : timedelta) -> None:
+        self.table = table
+        # one more slot for rounding down and one for the current second
+        self.size = int(horizon.total_seconds()) + 2
+        self.slots: List[List[Tuple[int, Hashable]]] = [[] for _ in range(self.size)]
+        # next tick whose slot wasn't yet processed
+        self.cursor: Optional[int] = None
+        self.evictions = 0
+
+    def schedule(self, key : Hashable, deadline : datetime) -> None:
+        tick = to_tick(deadline)
+        slot = self.slots[tick % self.size]
+        entry = (tick, key)
+        # a hot key is scheduled at the same tick over and over
+        if slot and slot[-1] == entry:
+            return
+        slot.append(entry)
+
+    def advance(self, now : datetime) -> None:
+        "Evict everything that expired strictly before now"
+        self.advance_to(to_tick(now), now)
+
+    def advance_to(self, tick : int, now : datetime) -> None:
+        "The same as advance, for callers that already know the tick of now"
+        if self.cursor is None:
+            self.cursor = tick
+            return
+        if tick <= self.cursor:
+            return
+
+        # after a long pause there is no need to walk the wheel many times
+        end = min(tick, self.cursor + self.size)
+        for t in range(self.cursor, end):
+            self.expire_slot(t % self.size, tick, now)
+        self.cursor = tick
+
+    def expire_slot(self, index : int, tick : int, now : datetime) -> None:
+        slot = self.slots[index]
+        if not slot:
+            return
+        # entries from next turns of the wheel stay in place
+        keep = []
+        for entry in slot:
+            entry_tick, key = entry
+            if entry_tick >= tick:
+                keep.append(entry)
+                continue
+            status = self.table.get(key)
+            if status is not None and status.deadline() < now:
+                del self.table[key]
+                self.evictions += 1
+        self.slots[index] = keep
+
+    def __len__(self) -> int:
+        "Amount of scheduled entries, including stale ones"
+        return sum(map(len, self.slots))
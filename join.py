@@ -3,6 +3,8 @@
 from typing import *
 from html import escape
 from telegram import Message # type: ignore
+from snapshot import MessageSnapshot
+from content import key_of
 
 """
 Author: d86leader@mail.com, 2019
@@ -14,127 +16,201 @@ action (with a counter for example) you execute Joiner#join() and it tells you
 whether you need to send a new message or edit an existing one.
 Important! After sending a message you need to execute Joiner#message_sent()
 with the message you have sent and any user message that has triggered you.
+User messages are passed around as snapshots, see snapshot.py.
 Also or on some timer, you should execute Joiner#cleanup() so this won't decide
 to join messages to a very old thread.
+
+The text of a joined message only grows, so it's kept as a list of lines that
+is joined into a string only when the text is actually sent. Actions carry the
+buffer itself, so an edit that is delayed and coalesced with later ones is
+rendered once, with the latest text.
+
+When a joined message is about to get longer than telegram allows, joiner
+sends a new message that continues it, and edits that one from then on.
+Lengths are counted on the escaped text, which can only be longer than what
+telegram counts.
 """
 
+# telegram doesn't allow messages longer than this
+MessageLimit = 4096
+
+
+class TextBuffer:
+    "Append-only text of a joined message, rendered only when needed"
+    __slots__ = ("lines", "length", "rendered")
+
+    def __init__(self, lines : Iterable[str] = ()) -> None:
+        self.lines: List[str] = []
+        # length of the rendered text
+        self.length = 0
+        # amount of lines rendered and the result. Edits are rendered in
+        # another thread, so the cache is checked against the lines instead
+        # of being reset on append
+        self.rendered: Tuple[int, str] = (0, "")
+        self.extend(lines)
+
+    def append(self, line : str) -> None:
+        if self.lines:
+            self.length += 1 # for the newline
+        self.lines.append(line)
+        self.length += len(line)
+
+    def extend(self, lines : Iterable[str]) -> None:
+        for line in lines:
+            self.append(line)
+
+    def render(self) -> str:
+        rendered = self.rendered
+        if rendered[0] != len(self.lines):
+            lines = self.lines[:]
+            rendered = (len(lines), "\n".join(lines))
+            self.rendered = rendered
+        return rendered[1]
+
+    def __str__(self) -> str:
+        return self.render()
+
+    def __len__(self) -> int:
+        return self.length
+
+
 # complex keys for our tables
 UID = NamedTuple("UID", [("chat_id", int)
                         ,("from_id", int)
                         ])
 BodyID = NamedTuple("BodyID", [("chat_id", int)
-                              ,("text", str)
+                              ,("content", Optional[int]) # see content.py
                               ])
 MsgID = NamedTuple("MsgID", [("chat_id", int)
                             ,("msg_id", int)
                             ])
+RaidID = NamedTuple("RaidID", [("chat_id", int)])
 MessageInfo = NamedTuple("MessageInfo",
-        [("message_id",   Optional[int])
-        ,("current_text", str)
+        [("message_id", Optional[int])
+        ,("text",       TextBuffer)
         ])
 
 
 class Action:
     pass
 class SendMessage(Action):
-    def __init__(self, chat_id : int, text : str) -> None:
+    def __init__(self, chat_id : int, text : Union[str, TextBuffer]) -> None:
         self.chat_id = chat_id
-        self.text = text
+        self.body = text
+    @property
+    def text(self) -> str:
+        return str(self.body)
 class EditMessage(Action):
     def __init__(self, chat_id : int
                      , message_id : int
-                     , text : str
+                     , text : Union[str, TextBuffer]
                 ) -> None:
         self.chat_id = chat_id
         self.message_id = message_id
-        self.text = text
+        self.body = text
+    @property
+    def text(self) -> str:
+        return str(self.body)
 
 
 class Joiner:
-    def __init__(self) -> None:
-        self.user_bases: Dict[UID, MessageInfo] = {}
-        self.content_bases: Dict[BodyID, MessageInfo] = {}
-        self.reply_bases: Dict[MsgID, MessageInfo] = {}
+    # tables can be given by a state store, see store.py
+    def __init__(self, user_bases : Optional[MutableMapping] = None
+                     , content_bases : Optional[MutableMapping] = None
+                     , reply_bases : Optional[MutableMapping] = None
+                     , raid_bases : Optional[MutableMapping] = None
+                ) -> None:
+        self.user_bases: MutableMapping[UID, MessageInfo] = {} if user_bases is None else user_bases
+        self.content_bases: MutableMapping[BodyID, MessageInfo] = {} if content_bases is None else content_bases
+        self.reply_bases: MutableMapping[MsgID, MessageInfo] = {} if reply_bases is None else reply_bases
+        # one digest per chat, replaced when the next raid starts
+        self.raid_bases: MutableMapping[RaidID, MessageInfo] = {} if raid_bases is None else raid_bases
 
-    def join(self, messages_a : List[Message]) -> Action:
+    def join(self, messages_a : List[MessageSnapshot]) -> Action:
         message = messages_a[0]
-        messages: Iterator[str] = map(lambda x: x.text, messages_a)
+        messages = list(map(lambda x: escape(x.text), messages_a))
 
-        chat_id = message.chat.id
-        from_id = message.from_user.id
+        chat_id = message.chat_id
+        from_id = message.from_id
         # throws something when fields not present
         user_id = UID(chat_id=chat_id, from_id=from_id)
 
-        if user_id not in self.user_bases:
-            author = message.from_user.full_name
-            link = message.from_user.link
-
-            text = f"<i><a href=\"{link}\">{author}</a> says:</i>\n"
-            text += "\n".join(map(escape, messages))
+        author = message.user.full_name
+        link = message.user.link
+        header = [f"<i><a href=\"{link}\">{author}</a> says:</i>"]
 
-            self.user_bases[user_id] = MessageInfo(message_id=None
-                                                  ,current_text=text
-                                                  )
-            return SendMessage(chat_id, text)
+        if user_id not in self.user_bases:
+            return self.start(self.user_bases, user_id, header, messages)
         else:
-            message_id, text = self.user_bases[user_id]
-            assert message_id is not None
-            if message_id == None:
-                raise RuntimeError("Encountered None as message id. Did you forget to call `sent_message`?")
-
-            text += "\n" + "\n".join(map(escape, messages))
-            self.user_bases[user_id] = MessageInfo(message_id, text)
-            return EditMessage(chat_id, message_id, text)
+            return self.extend(self.user_bases, user_id, header, messages)
 
-    def unite_content(self, messages : List[Message]) -> Action:
+    def unite_content(self, messages : List[MessageSnapshot]) -> Action:
         message = messages[0]
         chat_id = message.chat_id
-        content = message.text
-        key = BodyID(chat_id=chat_id, text=content)
+        key = BodyID(chat_id=chat_id, content=key_of(message))
 
+        header = [escape(message.text)]
+        signatures = list(map(format_signature, messages))
         if key not in self.content_bases:
-            text = message.text + "\n" + join_signatures(messages)
-            self.content_bases[key] = MessageInfo(None, text)
-            return SendMessage(chat_id, text)
+            return self.start(self.content_bases, key, header, signatures)
         else:
-            message_id, text = self.content_bases[key]
-            assert message_id is not None
-            if message_id == None:
-                raise RuntimeError("Encountered None as message id. Did you forget to call `sent_message`?")
-            text += "\n" + join_signatures(messages)
-            self.content_bases[key] = MessageInfo(message_id, text)
-            return EditMessage(chat_id, message_id, text)
-
-    def unite_reply(self, messages : List[Message]) -> Action:
+            return self.extend(self.content_bases, key, header, signatures)
+
+    def unite_reply(self, messages : List[MessageSnapshot]) -> Action:
         message = messages[0]
         chat_id = message.chat_id
-        reply_id = message.reply_to_message.message_id
+        reply_id = message.reply_to_id
         key = MsgID(chat_id=chat_id, msg_id=reply_id)
 
+        texts = list(map(format_user_text, messages))
         if key not in self.reply_bases:
-            text = join_users_texts(messages)
-            self.reply_bases[key] = MessageInfo(None, text)
-            return SendMessage(chat_id, text)
+            return self.start(self.reply_bases, key, [], texts)
         else:
-            message_id, text = self.reply_bases[key]
-            assert message_id is not None
-            if message_id == None:
-                raise RuntimeError("Encountered None as message id. Did you forget to call `sent_message`?")
-            text += "\n" + join_users_texts(messages)
-            self.reply_bases[key] = MessageInfo(message_id, text)
-            return EditMessage(chat_id, message_id, text)
-
+            return self.extend(self.reply_bases, key, [], texts)
+
+    def join_raid(self, messages : List[MessageSnapshot], fresh : bool) -> Action:
+        "Add messages to the digest of the raid in their chat"
+        key = RaidID(chat_id=messages[0].chat_id)
+        texts = list(map(format_user_text, messages))
+        if fresh or key not in self.raid_bases:
+            return self.start(self.raid_bases, key, [RaidHeader], texts)
+        else:
+            return self.extend(self.raid_bases, key, [RaidHeader], texts)
+
+    def start(self, bases : MutableMapping, key, header : List[str], lines : List[str]) -> Action:
+        "Send a new joined message"
+        text = new_text(header, lines)
+        bases[key] = MessageInfo(message_id=None, text=text)
+        return SendMessage(key.chat_id, text)
+
+    def extend(self, bases : MutableMapping, key, header : List[str], lines : List[str]) -> Action:
+        "Edit the joined message, or continue in a new one when it's full"
+        message_id, text = bases[key]
+        assert message_id is not None
+        if message_id == None:
+            raise RuntimeError("Encountered None as message id. Did you forget to call `sent_message`?")
+
+        added = sum(map(len, lines)) + len(lines)
+        if len(text) + added > MessageLimit:
+            # the old message stays as it is, and the following edits go to
+            # the new one after `sent_message`
+            return self.start(bases, key, header, lines)
+        text.extend(lines)
+        # written back for tables that aren't dicts
+        bases[key] = MessageInfo(message_id=message_id, text=text)
+        return EditMessage(key.chat_id, message_id, text)
 
 
     # cleanup when the first unification message was sent
-    def sent_message(self, user_message : Message, bot_message : Message) -> None:
+    def sent_message(self, user_message : MessageSnapshot, bot_message : Message) -> None:
         self.sent_message_join(user_message, bot_message)
         self.sent_message_content(user_message, bot_message)
         self.sent_message_reply(user_message, bot_message)
+        self.sent_message_raid(user_message, bot_message)
 
-    def sent_message_join(self, user_message : Message, bot_message : Message) -> None:
-        chat_id = user_message.chat.id
-        from_id = user_message.from_user.id
+    def sent_message_join(self, user_message : MessageSnapshot, bot_message : Message) -> None:
+        chat_id = user_message.chat_id
+        from_id = user_message.from_id
         user_id = UID(chat_id=chat_id, from_id=from_id)
 
         if user_id not in self.user_bases:
@@ -143,13 +219,12 @@ class Joiner:
         # insert the missing message_id which is used fo editing further
         _, text = self.user_bases[user_id]
         self.user_bases[user_id] = MessageInfo(message_id=bot_message.message_id
-                                              ,current_text=text
+                                              ,text=text
                                               )
 
-    def sent_message_content(self, user_message : Message, bot_message : Message) -> None:
-        chat_id = user_message.chat.id
-        content = user_message.text
-        key = BodyID(chat_id=chat_id, text=content)
+    def sent_message_content(self, user_message : MessageSnapshot, bot_message : Message) -> None:
+        chat_id = user_message.chat_id
+        key = BodyID(chat_id=chat_id, content=key_of(user_message))
 
         if key not in self.content_bases:
             return
@@ -157,14 +232,14 @@ class Joiner:
         # insert the missing message_id which is used fo editing further
         _, text = self.content_bases[key]
         self.content_bases[key] = MessageInfo(message_id=bot_message.message_id
-                                             ,current_text=text
+                                             ,text=text
                                              )
 
-    def sent_message_reply(self, user_message : Message, bot_message : Message) -> None:
-        chat_id = user_message.chat.id
-        if not user_message.reply_to_message:
+    def sent_message_reply(self, user_message : MessageSnapshot, bot_message : Message) -> None:
+        chat_id = user_message.chat_id
+        if user_message.reply_to_id is None:
             return
-        reply_id = user_message.reply_to_message.message_id
+        reply_id = user_message.reply_to_id
         key = MsgID(chat_id=chat_id, msg_id=reply_id)
 
         if key not in self.reply_bases:
@@ -173,47 +248,89 @@ class Joiner:
         # insert the missing message_id which is used fo editing further
         _, text = self.reply_bases[key]
         self.reply_bases[key] = MessageInfo(message_id=bot_message.message_id
-                                           ,current_text=text
+                                           ,text=text
                                            )
 
 
+    def sent_message_raid(self, user_message : MessageSnapshot, bot_message : Message) -> None:
+        key = RaidID(chat_id=user_message.chat_id)
+        info = self.raid_bases.get(key)
+        # the digest outlives the raid, only a new one is waiting for its id
+        if info is None or info.message_id is not None:
+            return
+        self.raid_bases[key] = MessageInfo(message_id=bot_message.message_id
+                                          ,text=info.text
+                                          )
+
+
     # when user no longer needs joining, cleanup their data from collection
-    def cleanup(self, message : Message) -> None:
-        chat_id = message.chat.id
+    def cleanup(self, message : MessageSnapshot) -> None:
+        chat_id = message.chat_id
 
-        from_id = message.from_user.id
+        from_id = message.from_id
         key1 = UID(chat_id=chat_id, from_id=from_id)
         if key1 in self.user_bases:
             del self.user_bases[key1]
 
-        content = message.text
-        key2 = BodyID(chat_id=chat_id, text=content)
+        key2 = BodyID(chat_id=chat_id, content=key_of(message))
         if key2 in self.content_bases:
             del self.content_bases[key2]
 
-        if message.reply_to_message != None:
-            reply_id = message.reply_to_message.message_id
+        if message.reply_to_id != None:
+            reply_id = message.reply_to_id
             key3 = MsgID(chat_id=chat_id, msg_id=reply_id)
             if key3 in self.reply_bases:
                 del self.reply_bases[key3]
 
+RaidHeader = "<i>Posted during a raid:</i>"
+
+def new_text(header : List[str], lines : List[str]) -> TextBuffer:
+    "Text of a new joined message, with lines cut to fit into the limit"
+    text = TextBuffer()
+    for line in header + lines:
+        room = MessageLimit - len(text) - (1 if text.lines else 0)
+        cut = cut_line(line, room)
+        if cut is None:
+            break
+        text.append(cut)
+    return text
+
+def cut_line(line : str, room : int) -> Optional[str]:
+    "Shorten escaped html to fit in room, without breaking tags and entities"
+    if len(line) <= room:
+        return line
+    # text after the last tag is plain
+    plain_start = line.rfind(">") + 1
+    if room < plain_start + 2:
+        return None
+    cut = line[:room - 1]
+    amp = cut.rfind("&")
+    if amp >= plain_start and ";" not in cut[amp:]:
+        cut = cut[:amp]
+    return cut + "…"
+
+
+def format_signature(msg) -> str:
+    "Sign-off of who wrote a message"
+    link = msg.user.link
+    name = msg.user.full_name
+    return f" - <i><a href=\"{link}\">{name}</a></i>"
+
 def join_signatures(messages: list) -> str:
     "Join as as sign-off of who wrote the messages"
-    def format_one(msg) -> str:
-        link = msg.from_user.link
-        name = msg.from_user.full_name
-        return f" - <i><a href=\"{link}\">{name}</a></i>"
-    return "\n".join(map(format_one, messages))
+    return "\n".join(map(format_signature, messages))
+
 
+def format_user_text(msg) -> str:
+    "A message with its author, shortened"
+    link = msg.user.link
+    name = msg.user.full_name
+    text = msg.text
+    if len(msg.text) > 32:
+        text = msg.text[:32] + "..."
+    text = escape(text)
+    return f"<i><a href=\"{link}\">{name}</a></i>: {text}"
 
 def join_users_texts(messages: list) -> str:
     "Join messages from different users prettily"
-    def format_one(msg) -> str:
-        link = msg.from_user.link
-        name = msg.from_user.full_name
-        text = msg.text
-        if len(msg.text) > 32:
-            text = msg.text[:32] + "..."
-        text = escape(text)
-        return f"<i><a href=\"{link}\">{name}</a></i>: {text}"
-    return "\n".join(map(format_one, messages))
+    return "\n".join(map(format_user_text, messages))
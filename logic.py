@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
 from typing import *
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from datetime import datetime, timedelta
-from sortedcollection import SortedCollection
-from copy import copy
+from window import RingWindow
+from expiry import ExpiryWheel, to_tick
+from snapshot import MessageSnapshot, is_forwarded
+from content import content_key, NearDuplicates
 from abc import ABC, abstractmethod
 
 """
@@ -17,6 +19,16 @@ delete and join them into one new message. Then each new messages from the same
 user will be appended to the message. This stops if the user hasn't sent
 anything in last 10 seconds.
 
+Counters work on snapshots of messages (see snapshot.py), and actions carry
+those snapshots instead of telegram messages.
+Counters forget users and messages as soon as their status can no longer
+affect a decision, see expiry.py for how.
+
+Besides that, RaidMessageCounter watches how fast users without history in a
+chat post there. When many of them post at once, as in a raid of fresh
+accounts that each post only a couple of messages, the chat goes into raid
+mode, and all messages of such users are joined into one digest.
+
 Usage: create an instance of MessageCounter and call decide() method,
 and it will tell you what to do. The method is highly stateful. It's best if
 it's called on all arriving messages.
@@ -26,7 +38,19 @@ it's called on all arriving messages.
 DelayDelete = timedelta(seconds=15)
 DelayRelease = timedelta(seconds=10)
 MessageThreshold = 5
-ContentMaxLength = 32
+# unite texts that differ a little, see content.py
+NearDuplicateContent = False
+
+# a chat is raided when users without history post this many messages in
+# RaidWindow, and the raid stops RaidRelease after that was last the case
+RaidWindow = timedelta(seconds=10)
+RaidThreshold = 20
+RaidRelease = timedelta(seconds=60)
+# users with this many messages outside of raids have history
+RaidTrusted = 5
+# most users remembered in a chat, and how long a quiet chat is remembered
+RaidKnownUsers = 1000
+RaidHistory = timedelta(hours=1)
 
 
 # actions returned to caller:
@@ -36,16 +60,22 @@ class DoNothing(Action):
     pass
 class JoinUserMessages(Action):
     "Join multiple messages of single user"
-    def __init__(self, sources : list): # list of telegram messages
+    def __init__(self, sources : list): # list of message snapshots
         self.messages = sources
 class UniteMessagesContent(Action):
     "Unite identical messages of multiple users"
-    def __init__(self, sources : list): # list of telegram messages
+    def __init__(self, sources : list): # list of message snapshots
         self.messages = sources
 class UniteMessagesReply(Action):
     "Unite messages of multiple users based on what they replied to"
-    def __init__(self, sources : list): # list of telegram messages
+    def __init__(self, sources : list): # list of message snapshots
+        self.messages = sources
+class JoinRaidMessages(Action):
+    "Join messages of users without history into the digest of a raid"
+    def __init__(self, sources : list, fresh : bool): # list of message snapshots
         self.messages = sources
+        # the raid just started and needs a digest of its own
+        self.fresh = fresh
 
 
 class IMessageCounter(ABC):
@@ -57,31 +87,48 @@ class IMessageCounter(ABC):
 class MessageCounter(IMessageCounter):
     "Aggregate of multiple counters. What you want to use in main code"
     counters : List[IMessageCounter]
-    def __init__(self):
-        self.counters = [ UserMessageCounter()
-                        , ContentMessageCounter()
-                        ]
+    def __init__(self, counters : Optional[List[IMessageCounter]] = None):
+        if counters is None:
+            counters = [ RaidMessageCounter()
+                       , UserMessageCounter()
+                       , ContentMessageCounter()
+                       , ReplyMessageCounter()
+                       ]
+        self.counters = counters
 
     def decide(self, message) -> Action:
         if message == None:
             print("wut")
+        # take the snapshot once for all counters
+        snapshot = MessageSnapshot.of(message)
         for counter in self.counters:
-            decision = counter.decide(message)
+            decision = counter.decide(snapshot)
             if not isinstance(decision, DoNothing):
                 return decision
         return DoNothing()
 
-# telegram messages are not comparable, so we compare them
-# on their date with key function. This is a function
-# to create a correct collection
-def new_queue(item):
-    key = lambda x: x.date
-    return SortedCollection([item], key)
+    def live_entries(self) -> int:
+        "Amount of statuses currently tracked by all counters"
+        return sum(map(lambda c: len(c.msg_queue), self.counters))
+
+    def evictions(self) -> int:
+        "Amount of statuses forgotten because of expiry"
+        return sum(map(lambda c: c.expiry.evictions, self.counters))
+
+# snapshots are kept ordered on their date in a ring window. A lax status
+# switches as soon as it has MessageThreshold messages, so the window never
+# needs to be larger than that
+def new_queue(item) -> RingWindow:
+    return RingWindow(MessageThreshold, [item])
 
 # For each user/message in chat we keep their status
 class AbstractStatus(ABC):
     def update(self, message) -> 'AbstractStatus':
         return self
+    @abstractmethod
+    def deadline(self) -> datetime:
+        "After this time the status behaves as if it never existed"
+        ...
     def is_strict(self) -> bool:
         return False
     def is_lax(self) -> bool:
@@ -92,18 +139,15 @@ class StatusLax(AbstractStatus):
     "This carries a payload of recent posted messages"
 
     def __init__(self, initial_message):
-        self.queue = new_queue(copy(initial_message))
+        self.queue = new_queue(initial_message)
 
     def update(self, message) -> AbstractStatus:
         # insert the new message
-        self.queue.insert(copy(message))
+        self.queue.insert(message)
 
         # drop all old messages
-        latest_time = self.queue[-1].date
-        threshold_time = latest_time - DelayDelete
-
-        while len(self.queue) > 0 and self.queue[0].date <= threshold_time:
-            self.queue.drop_index(0)
+        latest_time = self.queue.latest()
+        self.queue.drop_until(latest_time - DelayDelete)
 
         # if the queue has too much late messages
         if len(self.queue) >= MessageThreshold:
@@ -112,6 +156,10 @@ class StatusLax(AbstractStatus):
         else:
             return self
 
+    def deadline(self) -> datetime:
+        # after this all messages in queue are dropped on next update
+        return self.queue.latest() + DelayDelete
+
     def is_lax(self) -> bool:
         return True
 
@@ -119,12 +167,13 @@ class StatusSwitching(AbstractStatus):
     "When switching from lax to strict"
     "Payload is recently posted messages to be united"
 
-    def __init__(self, messages):
-        self.messages = messages
+    def __init__(self, window : RingWindow) -> None:
+        self.messages = window.to_list()
+        self.latest = window.latest()
 
     def update(self, message) -> AbstractStatus:
         # compute stop time for strict status
-        stop_time = max(map(lambda x: x.date, self.messages)) + DelayRelease
+        stop_time = self.latest + DelayRelease
 
         if message.date <= stop_time:
             # switch completely to strict mode
@@ -133,6 +182,9 @@ class StatusSwitching(AbstractStatus):
         else:
             return StatusLax(message)
 
+    def deadline(self) -> datetime:
+        return self.latest + DelayRelease
+
     def is_strict(self) -> bool:
         return True
 
@@ -154,16 +206,38 @@ class StatusStrict(AbstractStatus):
         else:
             return StatusLax(message)
 
+    def deadline(self) -> datetime:
+        return self.stop_time
+
     def is_strict(self) -> bool:
         return True
 
-def is_forwarded(msg) -> bool:
-    return ( msg.forward_from != None
-          or msg.forward_from_chat != None
-          or msg.forward_from_message_id != None
-          or msg.forward_signature != None
-          or msg.forward_date != None
-           )
+# longest time a status can live without updates
+ExpiryHorizon = max(DelayDelete, DelayRelease)
+
+
+def track(counter, key, message) -> AbstractStatus:
+    "Update the status of key in the counter table with the message"
+    table = counter.msg_queue
+    status = table.get(key)
+    if status is None:
+        new_status: AbstractStatus = StatusLax(message)
+    else:
+        new_status = status.update(message)
+    table[key] = new_status
+    counter.expiry.schedule(key, new_status.deadline())
+    return new_status
+
+def decision(action : Callable[[list], Action], status : AbstractStatus, message) -> Action:
+    "What the counter should say when a message got its key this status"
+    if isinstance(status, StatusSwitching):
+        # messages contains even the new message, no need to manually add
+        # it to insertion list
+        return action(status.messages)
+    elif isinstance(status, StatusStrict):
+        return action([message])
+    else:
+        return DoNothing()
 
 
 ##### UserMessageCounter implementation #####
@@ -177,40 +251,26 @@ UID = NamedTuple("UID", [("chat_id", int)
 UserCollection = Dict[UID, AbstractStatus]
 
 class UserMessageCounter(IMessageCounter):
+    key_type = UID
+
     def __init__(self, base_queue : UserCollection = {}) -> None:
         self.msg_queue = base_queue
+        self.expiry = ExpiryWheel(self.msg_queue, ExpiryHorizon)
 
     def decide(self, message) -> Action:
-        chat_id = message.chat.id
-        from_id = message.from_user.id
+        message = MessageSnapshot.of(message)
+        chat_id = message.chat_id
+        from_id = message.from_id
         time    = message.date
         if not chat_id or not from_id or not time:
             return DoNothing()
-        if is_forwarded(message):
+        if message.forwarded:
             # don't join forwared messages, there may be many and it's ok
             return DoNothing()
 
         user_id = UID(chat_id=chat_id, from_id=from_id)
-
-        if user_id not in self.msg_queue:
-            self.msg_queue[user_id] = StatusLax(message)
-            return DoNothing()
-
-        new_status = self.msg_queue[user_id].update(message)
-        self.msg_queue[user_id] = new_status
-
-        if new_status.is_lax():
-            return DoNothing()
-
-        if isinstance(new_status, StatusSwitching):
-            return JoinUserMessages(new_status.messages)
-            # messages contains even the new message, no need to manually add
-            # it to insertion list
-        elif isinstance(new_status, StatusStrict):
-            return JoinUserMessages([message])
-        else:
-            # this is impossible state, but type checker doesn't know that
-            return DoNothing()
+        self.expiry.advance(time)
+        return decision(JoinUserMessages, track(self, user_id, message), message)
 
 
 ##### ContentMessageCounter implementation #####
@@ -218,47 +278,250 @@ class UserMessageCounter(IMessageCounter):
 
 # a complex key for our table
 MsgID = NamedTuple("UID", [("chat_id", int)
-                          ,("content", str) # keep shorter
+                          ,("content", int) # hash of the normalised text
                           ])
 
 MessageCollection = Dict[MsgID, AbstractStatus]
 
 class ContentMessageCounter(ABC):
-    def __init__(self, base_queue : MessageCollection = {}) -> None:
+    key_type = MsgID
+
+    def __init__(self, base_queue : MessageCollection = {}
+                     , near : Optional[NearDuplicates] = None
+                ) -> None:
         self.msg_queue = base_queue
+        self.expiry = ExpiryWheel(self.msg_queue, ExpiryHorizon)
+        if near is None and NearDuplicateContent:
+            near = NearDuplicates()
+        self.near = near
+
+    def content_key(self, message : MessageSnapshot) -> int:
+        "Key of the text, remembered in the snapshot for the joiner"
+        if self.near is None:
+            key = content_key(message.text)
+        else:
+            key = self.near.key(message.chat_id, message.text)
+        message.content_key = key
+        return key
 
     def decide(self, message) -> Action:
-        chat_id = message.chat.id
+        message = MessageSnapshot.of(message)
+        chat_id = message.chat_id
         text    = message.text
         time    = message.date
 
         if not chat_id or not text or not time:
             return DoNothing()
-        if is_forwarded(message):
+        if message.forwarded:
             # don't join forwared messages, there may be many and it's ok
             return DoNothing()
-        if len(text) > ContentMaxLength:
-            # ignore messages that are too long. For memory's sake
-            return DoNothing()
 
-        msg_id = MsgID(chat_id = chat_id, content = text)
+        msg_id = MsgID(chat_id = chat_id, content = self.content_key(message))
+        self.expiry.advance(time)
+        return decision(UniteMessagesContent, track(self, msg_id, message), message)
+
 
-        if msg_id not in self.msg_queue:
-            self.msg_queue[msg_id] = StatusLax(message)
+##### ReplyMessageCounter implementation #####
+
+
+# a complex key for our table
+ReplyID = NamedTuple("ReplyID", [("chat_id", int)
+                                ,("reply_to_id", int)
+                                ])
+
+ReplyCollection = Dict[ReplyID, AbstractStatus]
+
+class ReplyMessageCounter(IMessageCounter):
+    "Unites many users replying to the same message"
+    key_type = ReplyID
+
+    # A message that gets thousands of replies costs as much as any other
+    # key: lax and switching statuses keep at most MessageThreshold replies,
+    # and a strict one keeps none
+    def __init__(self, base_queue : ReplyCollection = {}) -> None:
+        self.msg_queue = base_queue
+        self.expiry = ExpiryWheel(self.msg_queue, ExpiryHorizon)
+
+    def decide(self, message) -> Action:
+        message = MessageSnapshot.of(message)
+        chat_id     = message.chat_id
+        reply_to_id = message.reply_to_id
+        time        = message.date
+
+        if not chat_id or reply_to_id is None or not time:
             return DoNothing()
+        if message.forwarded:
+            # don't join forwared messages, there may be many and it's ok
+            return DoNothing()
+
+        reply_id = ReplyID(chat_id=chat_id, reply_to_id=reply_to_id)
+        self.expiry.advance(time)
+        return decision(UniteMessagesReply, track(self, reply_id, message), message)
+
 
-        new_status = self.msg_queue[msg_id].update(message)
-        self.msg_queue[msg_id] = new_status
+##### RaidMessageCounter implementation #####
+
+
+# a complex key for our table
+ChatID = NamedTuple("ChatID", [("chat_id", int)])
+
+class ChatActivity(AbstractStatus):
+    """
+    Recent activity of a chat. Messages of users without history are counted
+    in one slot per second of RaidWindow, so the count over the window
+    changes in O(1) per message. Users are remembered by the amount of
+    messages they posted outside of raids, at most RaidKnownUsers of them,
+    the least recently active forgotten first.
+    """
+    __slots__ = ("counts", "tick", "total", "latest", "raid_until", "known")
+
+    def __init__(self, time : datetime) -> None:
+        self.counts = [0] * int(RaidWindow.total_seconds())
+        self.tick = to_tick(time)
+        self.total = 0
+        self.latest = time
+        self.raid_until: Optional[datetime] = None
+        # user id -> messages outside of raids, in order of activity
+        self.known: OrderedDict = OrderedDict()
+
+    def count(self, tick : int) -> int:
+        "Count a message posted at tick, and return the count over the window"
+        counts = self.counts
+        size = len(counts)
+        if tick > self.tick:
+            # slots of seconds that left the window are emptied
+            for t in range(self.tick + 1, min(tick, self.tick + size) + 1):
+                self.total -= counts[t % size]
+                counts[t % size] = 0
+            self.tick = tick
+        # a late message is counted as if it came now
+        counts[self.tick % size] += 1
+        self.total += 1
+        return self.total
+
+    def trusted(self, user_id : int) -> bool:
+        return self.known.get(user_id, 0) >= RaidTrusted
+
+    def remember(self, user_id : int) -> None:
+        known = self.known
+        known[user_id] = known.pop(user_id, 0) + 1
+        if len(known) > RaidKnownUsers:
+            known.popitem(last=False)
+
+    def in_raid(self, time : datetime) -> bool:
+        return self.raid_until is not None and time <= self.raid_until
+
+    def deadline(self) -> datetime:
+        deadline = self.latest + RaidHistory
+        if self.raid_until is not None:
+            deadline = max(deadline, self.raid_until)
+        return deadline
+
+
+ActivityCollection = Dict[ChatID, ChatActivity]
+
+class RaidMessageCounter(IMessageCounter):
+    "Joins messages of users without history while a chat is raided"
+    key_type = ChatID
+
+    def __init__(self, base_queue : ActivityCollection = {}) -> None:
+        self.msg_queue = base_queue
+        self.expiry = ExpiryWheel(self.msg_queue, max(RaidHistory, RaidRelease))
 
-        if new_status.is_lax():
+    def decide(self, message) -> Action:
+        message = MessageSnapshot.of(message)
+        chat_id = message.chat_id
+        from_id = message.from_id
+        time    = message.date
+        if not chat_id or not from_id or not time:
             return DoNothing()
+        # forwarded messages are counted too, raids often forward spam
+
+        key = ChatID(chat_id)
+        self.expiry.advance(time)
+        table = self.msg_queue
+        activity = table.get(key)
+        if activity is None:
+            activity = ChatActivity(time)
+        raided = activity.in_raid(time)
+        fresh = False
+        trusted = activity.trusted(from_id)
+
+        if not trusted and activity.count(to_tick(time)) >= RaidThreshold:
+            fresh = not raided
+            raided = True
+            activity.raid_until = time + RaidRelease
+        if not raided:
+            # raiders don't earn history by raiding
+            activity.remember(from_id)
+        activity.latest = max(activity.latest, time)
+        # written back for tables that aren't dicts
+        table[key] = activity
+        self.expiry.schedule(key, activity.deadline())
+
+        if raided and not trusted:
+            return JoinRaidMessages([message], fresh)
+        return DoNothing()
 
-        if isinstance(new_status, StatusSwitching):
-            return UniteMessagesContent(new_status.messages)
-            # messages contains even the new message, no need to manually add
-            # it to insertion list
-        elif isinstance(new_status, StatusStrict):
-            return UniteMessagesContent([message])
-        else:
-            # this is impossible state, but type checker doesn't know that
+
+##### FusedMessageCounter implementation #####
+
+
+class FusedMessageCounter(MessageCounter):
+    """
+    The same counters as MessageCounter, but every message updates all of
+    them in one pass. In the chain a message stops at the first counter
+    that acts, so the others never count it. Here all of them do, and when
+    more than one wants to act, the raid counter goes first, then the user
+    counter, the content counter and the reply counter.
+    """
+
+    def __init__(self, user : Optional[UserMessageCounter] = None
+                     , content : Optional[ContentMessageCounter] = None
+                     , reply : Optional[ReplyMessageCounter] = None
+                     , raid : Optional[RaidMessageCounter] = None
+                ) -> None:
+        self.user = UserMessageCounter() if user is None else user
+        self.content = ContentMessageCounter() if content is None else content
+        self.reply = ReplyMessageCounter() if reply is None else reply
+        self.raid = RaidMessageCounter() if raid is None else raid
+        super().__init__([self.raid, self.user, self.content, self.reply])
+
+    def decide(self, message) -> Action:
+        message = MessageSnapshot.of(message)
+        chat_id = message.chat_id
+        time    = message.date
+        if not chat_id or not time:
             return DoNothing()
+        # the raid counter sees forwarded messages too
+        result = self.raid.decide(message)
+        if message.forwarded:
+            # don't join forwared messages, there may be many and it's ok
+            return result
+        from_id     = message.from_id
+        text        = message.text
+        reply_to_id = message.reply_to_id
+
+        # all wheels move together
+        tick = to_tick(time)
+        for counter in (self.user, self.content, self.reply):
+            counter.expiry.advance_to(tick, time)
+
+        # plain tuples are equal to the named keys and faster to make
+        if from_id:
+            status = track(self.user, (chat_id, from_id), message)
+            if not status.is_lax() and isinstance(result, DoNothing):
+                result = decision(JoinUserMessages, status, message)
+
+        if text:
+            content = self.content
+            status = track(content, (chat_id, content.content_key(message)), message)
+            if not status.is_lax() and isinstance(result, DoNothing):
+                result = decision(UniteMessagesContent, status, message)
+
+        if reply_to_id is not None:
+            status = track(self.reply, (chat_id, reply_to_id), message)
+            if not status.is_lax() and isinstance(result, DoNothing):
+                result = decision(UniteMessagesReply, status, message)
+
+        return result
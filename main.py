@@ -7,13 +7,23 @@ License: published under GNU GPL-3
 Usage:
 Press Ctrl-C on the command line or send a signal to the process to stop the
 bot.
+Send SIGUSR2 to the process, or /profile from one of ProfilerAdmins, to start
+or stop the sampling profiler, see profiler.py.
 """
 
+from typing import *
 import logging
-import logic
-import join
+import signal
+import persist
+import store
+from deleter import DeletionQueue
+from editor import EditCoalescer
+from scheduler import ApiScheduler, GlobalRate
+from pipeline import Pipeline
+from snapshot import MessageSnapshot
+from metrics import Metrics, MetricsServer
+from profiler import SamplingProfiler
 from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, Handler, CallbackContext # type: ignore
-from telegram.error import BadRequest # type: ignore
 from telegram import Update # type: ignore
 
 # Enable logging
@@ -22,6 +32,11 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 
 logger = logging.getLogger(__name__)
 
+# serve prometheus metrics on this port of localhost, None to turn them off
+MetricsPort: Optional[int] = None
+# users allowed to toggle the profiler with /profile
+ProfilerAdmins: Set[int] = set()
+
 
 # Define a few command handlers. These usually take the two arguments bot and
 # update. Error handlers also receive the raised TelegramError object in error.
@@ -30,64 +45,102 @@ def start(update : Update, context : CallbackContext):
     update.message.reply_text('Hi!')
 
 
-def help(update : Update, context : CallbackContext):
-    """Send a message when the command /help is issued."""
-    message = """
+HelpText = """
     Hello! I'm a bot created to combat flood in supergroups. I'm a message join bot!
 See my github: https://github.com/d86leader/message_join_bot for more info.
 If you want to use this bot in your group, please set up your own copy. I'm currently running on {platform}.
     """.format(platform="Cavium ThunderX 88XX")
-    update.message.reply_text(message)
 
 
-def reply(counter, joiner):
+def help(update : Update, context : CallbackContext):
+    """Send a message when the command /help is issued."""
+    update.message.reply_text(HelpText)
+
+
+def reply(pipeline : Pipeline):
     def internal(update : Update, context : CallbackContext) -> None:
-        bot = context.bot
-        decision = counter.decide(update.message)
+        pipeline.handle(MessageSnapshot.of(update.message))
+    return internal
+
 
-        if isinstance(decision, logic.DoNothing):
-            joiner.cleanup(update.message)
+def profile(profiler : SamplingProfiler):
+    def internal(update : Update, context : CallbackContext) -> None:
+        """Toggle the profiler when /profile is issued by an admin."""
+        if update.effective_user is None or update.effective_user.id not in ProfilerAdmins:
             return
-        elif isinstance(decision, logic.UniteMessagesContent):
-            user_messages = decision.messages
-            decision = joiner.unite_content(user_messages)
-        elif isinstance(decision, logic.UniteMessagesReply):
-            user_messages = decision.messages
-            decision = joiner.unite_reply(user_messages)
-        elif isinstance(decision, logic.JoinUserMessages):
-            user_messages = decision.messages
-            decision = joiner.join(user_messages)
-
-        if isinstance(decision, join.SendMessage):
-            did_send = bot.send_message(
-                    chat_id = decision.chat_id
-                    ,text   = decision.text
-                    ,parse_mode = "HTML"
-                    ,disable_web_page_preview = True
-                    )
-            joiner.sent_message(update.message, did_send)
-        elif isinstance(decision, join.EditMessage):
-            bot.edit_message_text(
-                    chat_id     = decision.chat_id
-                    ,message_id = decision.message_id
-                    ,text       = decision.text
-                    ,parse_mode = "HTML"
-                    ,disable_web_page_preview = True
-                    )
-        # delete user's messages
-        for msg in user_messages:
-            try:
-                bot.delete_message(msg.chat.id, msg.message_id)
-            except BadRequest:
-                # this happens because some messages are told to be deleted
-                # twice because of multiple counters
-                pass
+        running = profiler.toggle()
+        update.message.reply_text("Profiling" if running else f"Profile saved to {profiler.path}")
+    return internal
+
+
+def error(metrics : Optional[Metrics]):
+    def internal(update : Update, context : CallbackContext) -> None:
+        """Log Errors caused by Updates."""
+        logger.warning('Update "%s" caused error "%s"', update, context.error)
+        if metrics is not None:
+            metrics.counter("joinbot_update_errors_total", "Updates that caused errors"
+                           ,error=type(context.error).__name__).inc()
     return internal
 
 
-def error(update : Update, context : CallbackContext):
-    """Log Errors caused by Updates."""
-    logger.warning('Update "%s" caused error "%s"', update, context.error)
+def make_pipeline(bot, store_path : Optional[str] = None
+                 ,api_share : float = 1.0
+                 ,metrics : Optional[Metrics] = None
+                 ) -> Tuple[Pipeline, Callable[[], None]]:
+    """Set up everything between the bot and the updates.
+    Returns the pipeline and a function to call when the bot stops.
+    With store_path the state is kept in a sqlite database there, otherwise
+    in memory with snapshots saved to a file. api_share is the part of the
+    global api rate this pipeline may use."""
+    # all bot api calls go through the rate limiting scheduler
+    api = ApiScheduler(bot, global_rate=GlobalRate * api_share, metrics=metrics)
+    deleter = DeletionQueue(api)
+    editor = EditCoalescer(api)
+
+    if store_path is None:
+        state: store.StateStore = store.MemoryStore()
+    else:
+        state = store.SqliteStore(store_path)
+    counter = store.make_counter(state)
+    joiner = store.make_joiner(state)
+    pipeline = Pipeline(counter, joiner, api, editor, deleter, metrics)
+    if metrics is not None:
+        watch(metrics, pipeline)
+    snapshotter = None
+    if store_path is None:
+        persist.restore(counter, joiner, persist.StatePath)
+        snapshotter = persist.Snapshotter(persist.StatePath, counter, joiner, pipeline.lock)
+
+    def stop() -> None:
+        editor.stop()
+        deleter.stop()
+        api.stop()
+        if snapshotter is not None:
+            snapshotter.stop()
+        with pipeline.lock:
+            state.close()
+    return pipeline, stop
+
+
+def watch(metrics : Metrics, pipeline : Pipeline) -> None:
+    "Gauges of tables and background queues"
+    api, editor, deleter = pipeline.api, pipeline.editor, pipeline.deleter
+    metrics.gauge("joinbot_table_entries", "Entries in counter and joiner tables"
+                 ,pipeline.table_sizes)
+    metrics.gauge("joinbot_api_queued", "Bot api calls waiting in queue"
+                 ,lambda: {(("kind", kind[len("queued_"):]),): value
+                           for kind, value in api.stats().items()
+                           if kind.startswith("queued_")})
+    metrics.gauge("joinbot_edits_total", "Edits asked for, sent and saved by coalescing"
+                 ,lambda: { (("state", "requested"),): editor.requested
+                          , (("state", "sent"),): editor.sent
+                          , (("state", "saved"),): editor.saved
+                          })
+    metrics.gauge("joinbot_deletions_total", "Deleted messages and delete requests"
+                 ,lambda: { (("state", "requests"),): deleter.requests
+                          , (("state", "deleted"),): deleter.deleted
+                          , (("state", "failed"),): deleter.failed
+                          })
 
 
 def main(token):
@@ -98,11 +151,19 @@ def main(token):
     dp.add_handler(CommandHandler("start", start))
     dp.add_handler(CommandHandler("help", help))
 
-    reply_func = reply(logic.MessageCounter(), join.Joiner())
+    metrics = None if MetricsPort is None else Metrics()
+    pipeline, stop = make_pipeline(updater.bot, metrics=metrics)
+    profiler = SamplingProfiler()
+    reply_func = profiler.wrap(reply(pipeline))
     dp.add_handler(MessageHandler(Filters.text, reply_func))
+    dp.add_handler(CommandHandler("profile", profile(profiler)))
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.toggle())
 
     # log all errors
-#     dp.add_error_handler(error)
+    dp.add_error_handler(error(metrics))
+    server = None
+    if metrics is not None:
+        server = MetricsServer(metrics, "127.0.0.1", MetricsPort)
 
     # Start the Bot
     updater.start_polling()
@@ -111,6 +172,10 @@ def main(token):
     # SIGTERM or SIGABRT. This should be used most of the time, since
     # start_polling() is non-blocking and will stop the bot gracefully.
     updater.idle()
+    profiler.stop()
+    stop()
+    if server is not None:
+        server.stop()
 
 
 if __name__ == '__main__':
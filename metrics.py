@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+from typing import *
+from bisect import bisect_left
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import os
+import threading
+import logging
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: counters and histograms of what the bot does, in the prometheus
+text format. They are served over http for prometheus to scrape, or written
+to a file every so often, which the node exporter textfile collector reads.
+
+Metrics are off unless a Metrics instance is given to the pipeline and the
+scheduler. Then they check for None once per message or call, and that's
+all they cost. Gauges, like sizes of tables, are only computed on scrape.
+"""
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# seconds. decide() takes microseconds, api calls take up to seconds
+LatencyBuckets = ( 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001
+                 , 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0
+                 , 2.5, 5.0, 10.0
+                 )
+
+
+def format_labels(labels : Labels, extra : str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    __slots__ = ("value", "lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount : float = 1.0) -> None:
+        with self.lock:
+            self.value += amount
+
+    def render(self, name : str, labels : Labels) -> List[str]:
+        return [f"{name}{format_labels(labels)} {self.value}"]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "lock")
+
+    def __init__(self, buckets : Sequence[float] = LatencyBuckets) -> None:
+        self.buckets = tuple(buckets)
+        # the last one is for values above all buckets
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value : float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def render(self, name : str, labels : Labels) -> List[str]:
+        with self.lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, amount in zip(self.buckets, counts):
+            cumulative += amount
+            bucket = format_labels(labels, 'le="%s"' % bound)
+            lines.append(f"{name}_bucket{bucket} {cumulative}")
+        bucket = format_labels(labels, 'le="+Inf"')
+        lines.append(f"{name}_bucket{bucket} {count}")
+        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class Metrics:
+    "All metrics of the bot, by name and labels"
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # name -> (type, help)
+        self.families: Dict[str, Tuple[str, str]] = {}
+        self.series: Dict[str, Dict[Labels, Any]] = {}
+        # name -> function returning values by labels
+        self.gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def get(self, kind : str, make : Callable, name : str, help : str, labels : Labels):
+        series = self.series.get(name)
+        if series is not None:
+            metric = series.get(labels)
+            if metric is not None:
+                return metric
+        with self.lock:
+            self.families.setdefault(name, (kind, help))
+            series = self.series.setdefault(name, {})
+            if labels not in series:
+                series[labels] = make()
+            return series[labels]
+
+    def counter(self, name : str, help : str, **labels : str) -> Counter:
+        return self.get("counter", Counter, name, help, tuple(sorted(labels.items())))
+
+    def histogram(self, name : str, help : str, **labels : str) -> Histogram:
+        return self.get("histogram", Histogram, name, help, tuple(sorted(labels.items())))
+
+    def gauge(self, name : str, help : str
+                  , values : Callable[[], Dict[Labels, float]]
+             ) -> None:
+        "Values are asked for on every scrape"
+        with self.lock:
+            self.families[name] = ("gauge", help)
+            self.gauges[name] = values
+
+    def render(self) -> str:
+        with self.lock:
+            families = dict(self.families)
+            series = {name: dict(s) for name, s in self.series.items()}
+            gauges = dict(self.gauges)
+        lines = []
+        for name, (kind, help) in sorted(families.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in gauges:
+                try:
+                    values = gauges[name]()
+                except Exception:
+                    logger.exception("Could not get values of %s", name)
+                    continue
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            else:
+                for labels, metric in sorted(series.get(name, {}).items()):
+                    lines.extend(metric.render(name, labels))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    "Serves metrics on /metrics from a background thread"
+    daemon_threads = True
+
+    def __init__(self, metrics : Metrics, host : str, port : int) -> None:
+        self.metrics = metrics
+        super().__init__((host, port), MetricsHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode() # type: ignore
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format : str, *args) -> None:
+        # scrapes come every few seconds, don't log them
+        pass
+
+
+class MetricsDumper:
+    "Writes metrics to a file every period seconds"
+
+    def __init__(self, metrics : Metrics, path : str, period : float = 15.0) -> None:
+        self.metrics = metrics
+        self.path = path
+        self.period = period
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.period):
+            self.dump()
+
+    def dump(self) -> None:
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, "w") as f:
+                f.write(self.metrics.render())
+            # readers never see a half written file
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", self.path, e)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.dump()
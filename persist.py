@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+from typing import *
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+import gc
+import marshal
+import os
+import threading
+import logging
+import logic
+import join
+from snapshot import MessageSnapshot, UserRef
+from window import RingWindow
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: saving the state of counters and joiner to a file, so that a
+restarted bot continues floods where it left off: it keeps counting the
+messages of a flooding user, and keeps editing the same joined message instead
+of posting a new one.
+
+The state is converted to plain tuples and written with marshal, which is
+compact and fast to read back. Users are written once, not with every
+message. Statuses that expire before the state is
+loaded are skipped. A Snapshotter saves the state periodically from a
+background thread, and once more when the bot stops.
+"""
+
+logger = logging.getLogger(__name__)
+
+Magic = b"MJB3"
+# where the bot keeps its state between restarts
+StatePath = "state.bin"
+Epoch = datetime(1970, 1, 1)
+
+def to_timestamp(date : datetime) -> float:
+    return (date - Epoch).total_seconds()
+
+def from_timestamp(stamp : float) -> datetime:
+    return Epoch + timedelta(seconds=stamp)
+
+
+##### encoding #####
+
+
+class Encoder:
+    """
+    Converts state to plain tuples. Users are written once into a table of
+    their own, and messages only keep their ids.
+    """
+
+    def __init__(self) -> None:
+        self.users: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+        # many messages are posted in the same second
+        self.stamps: Dict[datetime, float] = {}
+
+    def message(self, msg : MessageSnapshot) -> tuple:
+        from_id = msg.from_id
+        if from_id not in self.users:
+            user = msg.user
+            self.users[from_id] = (getattr(user, "full_name", None), getattr(user, "link", None))
+        stamp = self.stamps.get(msg.date)
+        if stamp is None:
+            stamp = self.stamps[msg.date] = to_timestamp(msg.date)
+        return ( msg.chat_id, msg.message_id, from_id, stamp
+               , msg.text, msg.reply_to_id, msg.forwarded, msg.content_key
+               )
+
+    def status(self, status : logic.AbstractStatus) -> tuple:
+        message = self.message
+        if isinstance(status, logic.StatusStrict):
+            return ("strict", to_timestamp(status.stop_time))
+        elif isinstance(status, logic.StatusLax):
+            return ("lax", [message(m) for m in status.queue.to_list()])
+        elif isinstance(status, logic.StatusSwitching):
+            return ("switching", [message(m) for m in status.messages])
+        elif isinstance(status, logic.ChatActivity):
+            raid_until = status.raid_until
+            return ("activity", ( to_timestamp(status.latest), status.tick
+                                , list(status.counts), status.total
+                                , to_timestamp(raid_until) if raid_until is not None else None
+                                , list(status.known.items())
+                                ))
+        else:
+            raise TypeError(f"Unknown status {status!r}")
+
+    def counter(self, counters : List[Tuple[str, dict]]) -> list:
+        status = self.status
+        return [ (name, [(tuple(key), status(s)) for key, s in table.items()])
+                 for name, table in counters
+               ]
+
+
+class Decoder:
+    def __init__(self, users : Dict[int, Tuple[Optional[str], Optional[str]]]) -> None:
+        self.users = users
+        self.refs: Dict[int, UserRef] = {}
+        self.dates: Dict[float, datetime] = {}
+
+    def message(self, data : tuple) -> MessageSnapshot:
+        chat_id, message_id, from_id, stamp, text, reply_to_id, forwarded, content = data
+        user = self.refs.get(from_id)
+        if user is None and from_id is not None:
+            full_name, link = self.users[from_id]
+            user = self.refs[from_id] = UserRef(from_id, full_name, link)
+        date = self.dates.get(stamp)
+        if date is None:
+            date = self.dates[stamp] = from_timestamp(stamp)
+        message = MessageSnapshot(chat_id, message_id, user, date
+                                 ,text, reply_to_id, forwarded)
+        message.content_key = content
+        return message
+
+    def status(self, data : tuple) -> logic.AbstractStatus:
+        kind, payload = data
+        if kind == "strict":
+            return logic.StatusStrict(from_timestamp(payload))
+        if kind == "activity":
+            return self.activity(payload)
+        messages = [self.message(m) for m in payload]
+        if kind == "lax":
+            status = logic.StatusLax(messages[0])
+            for msg in messages[1:]:
+                status.queue.insert(msg)
+            return status
+        elif kind == "switching":
+            return logic.StatusSwitching(RingWindow(len(messages), messages))
+        else:
+            raise ValueError(f"Unknown status kind {kind!r}")
+
+
+    def activity(self, data : tuple) -> logic.ChatActivity:
+        latest, tick, counts, total, raid_until, known = data
+        activity = logic.ChatActivity(from_timestamp(latest))
+        if len(counts) == len(activity.counts):
+            activity.tick = tick
+            activity.counts = counts
+            activity.total = total
+        # otherwise the window changed, and the rate is counted anew
+        if raid_until is not None:
+            activity.raid_until = from_timestamp(raid_until)
+        activity.known.update(known)
+        return activity
+
+
+def encode_joiner(tables : List[dict]) -> list:
+    def encode_table(table : dict) -> list:
+        # messages that weren't sent yet can't be edited after restart
+        return [ (tuple(key), info.message_id, list(info.text.lines))
+                 for key, info in table.items()
+                 if info.message_id is not None
+               ]
+    return [encode_table(table) for table in tables]
+
+
+##### saving and loading #####
+
+
+@contextmanager
+def gc_paused():
+    "Millions of new tuples would make the collector walk the heap again and again"
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def copy_tables(counter : logic.MessageCounter, joiner : join.Joiner
+               ) -> Tuple[List[Tuple[str, dict]], List[dict]]:
+    counters = [(type(c).__name__, dict(c.msg_queue)) for c in counter.counters]
+    tables = [ dict(joiner.user_bases)
+             , dict(joiner.content_bases)
+             , dict(joiner.reply_bases)
+             , dict(joiner.raid_bases)
+             ]
+    return counters, tables
+
+
+def dump_state(counter : logic.MessageCounter, joiner : join.Joiner
+              ,path : str, lock : Optional[threading.Lock] = None
+              ) -> None:
+    "Save the state to path, replacing it atomically"
+    # only copying the tables happens under the lock. Statuses may still
+    # change while they're encoded, which at worst saves a message twice or
+    # misses the latest one
+    if lock is not None:
+        with lock:
+            counters, tables = copy_tables(counter, joiner)
+    else:
+        counters, tables = copy_tables(counter, joiner)
+    with gc_paused():
+        encoder = Encoder()
+        encoded = encoder.counter(counters)
+        state = (encoder.users, encoded, encode_joiner(tables))
+        data = marshal.dumps(state)
+
+    temp = path + ".tmp"
+    with open(temp, "wb") as f:
+        f.write(Magic)
+        f.write(data)
+    os.replace(temp, path)
+
+
+def load_state(counter : logic.MessageCounter, joiner : join.Joiner
+              ,path : str, now : Optional[datetime] = None
+              ) -> int:
+    "Restore the state saved in path. Returns amount of restored statuses"
+    if now is None:
+        now = datetime.utcnow()
+    with open(path, "rb") as f:
+        if f.read(len(Magic)) != Magic:
+            raise ValueError(f"{path} is not a state snapshot")
+        data = f.read()
+    with gc_paused():
+        return restore_state(counter, joiner, marshal.loads(data), now)
+
+
+def restore_state(counter : logic.MessageCounter, joiner : join.Joiner
+                 ,state : tuple, now : datetime
+                 ) -> int:
+    users, counters, joiner_tables = state
+    decoder = Decoder(users)
+
+    restored = 0
+    by_name = {type(c).__name__: c for c in counter.counters}
+    for name, entries in counters:
+        target = by_name.get(name)
+        if target is None:
+            logger.warning("Skipping state of unknown counter %s", name)
+            continue
+        for key, data in entries:
+            status = decoder.status(data)
+            deadline = status.deadline()
+            if deadline < now:
+                continue
+            key = target.key_type(*key)
+            target.msg_queue[key] = status
+            target.expiry.schedule(key, deadline)
+            restored += 1
+
+    tables = [ (joiner.user_bases, join.UID)
+             , (joiner.content_bases, join.BodyID)
+             , (joiner.reply_bases, join.MsgID)
+             , (joiner.raid_bases, join.RaidID)
+             ]
+    # snapshots from before raid digests have one table less
+    for (table, key_type), entries in zip(tables, joiner_tables):
+        for key, message_id, lines in entries:
+            # stale entries are cleaned up by the first message that isn't
+            # joined, before they could be edited
+            table[key_type(*key)] = join.MessageInfo(message_id, join.TextBuffer(lines))
+    return restored
+
+
+class Snapshotter:
+    "Saves the state to a file every period seconds, and when stopped"
+
+    def __init__(self, path : str
+                     , counter : logic.MessageCounter
+                     , joiner : join.Joiner
+                     , lock : threading.Lock
+                     , period : float = 60.0
+                ) -> None:
+        self.path = path
+        self.counter = counter
+        self.joiner = joiner
+        self.lock = lock
+        self.period = period
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        while not self.stopped.wait(self.period):
+            self.save()
+
+    def save(self) -> None:
+        try:
+            dump_state(self.counter, self.joiner, self.path, self.lock)
+        except OSError as e:
+            logger.warning("Could not save state to %s: %s", self.path, e)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+        self.save()
+
+
+def restore(counter : logic.MessageCounter, joiner : join.Joiner, path : str) -> None:
+    "Load the state at startup if there is one"
+    if not os.path.exists(path):
+        return
+    try:
+        restored = load_state(counter, joiner, path)
+        logger.info("Restored %s statuses from %s", restored, path)
+    except (ValueError, EOFError, TypeError) as e:
+        logger.warning("Could not restore state from %s: %s", path, e)
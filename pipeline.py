@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import threading
+import time
+import logging
+import logic
+import join
+from snapshot import MessageSnapshot
+from metrics import Metrics, Counter, Labels
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: what happens to a message after it arrives. Pipeline asks the
+counter what to do, asks the joiner what to post, posts it and deletes the
+user messages. It's used directly by the threaded bot in main.py.
+
+AsyncPipeline runs the same steps on an asyncio loop. Every chat has its own
+queue of messages and its own worker task, so messages of one chat are
+handled in order, while chats go in parallel. Deciding stays synchronous,
+it's cheap and doesn't touch the network. Sending a message is awaited on a
+thread pool, and edits and deletions are already done in the background by
+EditCoalescer and DeletionQueue. A chat waiting on a slow or rate limited send
+only holds up its own queue.
+
+With metrics (see metrics.py), Pipeline times every decision and counts
+decisions by action.
+"""
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+    "Decides on messages and carries out the decisions"
+
+    def __init__(self, counter : logic.IMessageCounter
+                     , joiner : join.Joiner
+                     , api
+                     , editor
+                     , deleter
+                     , metrics : Optional[Metrics] = None
+                ) -> None:
+        self.counter = counter
+        self.joiner = joiner
+        self.api = api
+        self.editor = editor
+        self.deleter = deleter
+        # held while counter and joiner change, so that they can be saved
+        # from another thread
+        self.lock = threading.Lock()
+        self.metrics = metrics
+        if metrics is not None:
+            self.decide_seconds = metrics.histogram(
+                    "joinbot_decide_seconds", "Time the counter takes to decide")
+            # action type -> counter of decisions
+            self.decisions: Dict[type, Counter] = {}
+
+    def decide(self, message : MessageSnapshot
+              ) -> Tuple[Optional[join.Action], List[MessageSnapshot]]:
+        "What to post and which user messages to delete"
+        with self.lock:
+            return self.decide_locked(message)
+
+    def decide_locked(self, message : MessageSnapshot
+                     ) -> Tuple[Optional[join.Action], List[MessageSnapshot]]:
+        if self.metrics is None:
+            decision = self.counter.decide(message)
+        else:
+            decision = self.measure_decide(message)
+
+        if isinstance(decision, logic.DoNothing):
+            self.joiner.cleanup(message)
+            return None, []
+        elif isinstance(decision, logic.UniteMessagesContent):
+            user_messages = decision.messages
+            action = self.joiner.unite_content(user_messages)
+        elif isinstance(decision, logic.UniteMessagesReply):
+            user_messages = decision.messages
+            action = self.joiner.unite_reply(user_messages)
+        elif isinstance(decision, logic.JoinUserMessages):
+            user_messages = decision.messages
+            action = self.joiner.join(user_messages)
+        elif isinstance(decision, logic.JoinRaidMessages):
+            user_messages = decision.messages
+            action = self.joiner.join_raid(user_messages, decision.fresh)
+        else:
+            return None, []
+        return action, user_messages
+
+    def measure_decide(self, message : MessageSnapshot) -> logic.Action:
+        start = time.perf_counter()
+        decision = self.counter.decide(message)
+        self.decide_seconds.observe(time.perf_counter() - start)
+        kind = type(decision)
+        counter = self.decisions.get(kind)
+        if counter is None:
+            assert self.metrics is not None
+            counter = self.decisions[kind] = self.metrics.counter(
+                    "joinbot_decisions_total", "Decisions by action"
+                    ,action=kind.__name__)
+        counter.inc()
+        return decision
+
+    def table_sizes(self) -> Dict[Labels, float]:
+        "Entries in every table of counters and joiner, for metrics"
+        with self.lock:
+            sizes = {(("table", type(c).__name__),): len(c.msg_queue)
+                     for c in self.counter.counters}
+            joiner = self.joiner
+            sizes[(("table", "user_bases"),)] = len(joiner.user_bases)
+            sizes[(("table", "content_bases"),)] = len(joiner.content_bases)
+            sizes[(("table", "reply_bases"),)] = len(joiner.reply_bases)
+            sizes[(("table", "raid_bases"),)] = len(joiner.raid_bases)
+        return sizes
+
+    def handle(self, message : MessageSnapshot) -> None:
+        action, user_messages = self.decide(message)
+        if isinstance(action, join.SendMessage):
+            did_send = self.send(action)
+            with self.lock:
+                self.joiner.sent_message(message, did_send)
+        elif isinstance(action, join.EditMessage):
+            # edits of the same message are sent at a limited rate
+            self.editor.edit(action)
+        self.delete(user_messages)
+
+    def send(self, action : join.SendMessage):
+        return self.api.send_message(
+                chat_id = action.chat_id
+                ,text   = action.text
+                ,parse_mode = "HTML"
+                ,disable_web_page_preview = True
+                )
+
+    def delete(self, user_messages : List[MessageSnapshot]) -> None:
+        # this happens in the background, batched with other messages of
+        # this chat
+        for msg in user_messages:
+            self.deleter.delete(msg.chat_id, msg.message_id)
+
+
+class AsyncPipeline:
+    "Handles chats in parallel and messages of each chat in order"
+
+    def __init__(self, pipeline : Pipeline
+                     , workers : int = 32
+                     , idle : float = 60.0
+                ) -> None:
+        self.pipeline = pipeline
+        # how long a chat worker waits for messages before it quits
+        self.idle = idle
+        self.executor = ThreadPoolExecutor(workers)
+        self.queues: Dict[int, asyncio.Queue] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+
+    def feed(self, message : MessageSnapshot) -> None:
+        "Queue a message for handling. Must be called from the event loop"
+        chat_id = message.chat_id
+        queue = self.queues.get(chat_id)
+        if queue is None:
+            queue = asyncio.Queue()
+            self.queues[chat_id] = queue
+            self.tasks[chat_id] = asyncio.ensure_future(self.worker(chat_id, queue))
+        queue.put_nowait(message)
+
+    async def worker(self, chat_id : int, queue : asyncio.Queue) -> None:
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), self.idle)
+            except asyncio.TimeoutError:
+                # nothing can be put in the queue between the timeout and
+                # here, so it's safe to quit
+                del self.queues[chat_id]
+                del self.tasks[chat_id]
+                return
+            try:
+                await self.handle(message)
+            except Exception:
+                logger.exception("Failed to handle message in chat %s", chat_id)
+            finally:
+                queue.task_done()
+
+    async def handle(self, message : MessageSnapshot) -> None:
+        pipeline = self.pipeline
+        action, user_messages = pipeline.decide(message)
+        if isinstance(action, join.SendMessage):
+            loop = asyncio.get_event_loop()
+            did_send = await loop.run_in_executor(self.executor, pipeline.send, action)
+            with pipeline.lock:
+                pipeline.joiner.sent_message(message, did_send)
+        elif isinstance(action, join.EditMessage):
+            pipeline.editor.edit(action)
+        pipeline.delete(user_messages)
+
+    async def drain(self) -> None:
+        "Wait until all queued messages are handled"
+        await asyncio.gather(*(q.join() for q in list(self.queues.values())))
+
+    async def close(self) -> None:
+        for task in list(self.tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+        self.queues.clear()
+        self.tasks.clear()
+        self.executor.shutdown()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+from typing import *
+from collections import Counter
+import os
+import sys
+import threading
+import time
+import logging
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: a sampling profiler to see where the time goes when the bot lags
+behind. Every few milliseconds a background thread looks at the stacks of
+threads that are inside a wrapped handler, and counts them. The counts are
+written to a file in the collapsed stack format, one stack per line with
+frames from the outermost separated by semicolons and the count at the end,
+which flamegraph.pl and speedscope read.
+
+The profiler is off until started, and a wrapped handler then costs one
+attribute check per call. It's meant to be toggled while the bot runs, by
+a signal or an admin command, see main.py.
+"""
+
+logger = logging.getLogger(__name__)
+
+# where collapsed stacks are written
+ProfilePath = "profile.folded"
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame) -> str:
+    "Stack of a frame, outermost first, in the collapsed format"
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.reverse()
+    return ";".join(names)
+
+
+class SamplingProfiler:
+    """
+    Samples threads running wrapped handlers every interval seconds, and
+    writes the stacks to path every period seconds and when stopped. With
+    all_threads, every thread but its own is sampled, wrapped or not.
+    """
+
+    def __init__(self, path : str = ProfilePath
+                     , interval : float = 0.005
+                     , period : float = 10.0
+                     , all_threads : bool = False
+                ) -> None:
+        self.path = path
+        self.interval = interval
+        self.period = period
+        self.all_threads = all_threads
+        self.running = False
+        # idents of threads inside wrapped handlers -> how deep
+        self.active: Dict[int, int] = {}
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def wrap(self, handler : Callable) -> Callable:
+        "Handler that is sampled while the profiler runs"
+        def internal(*args, **kwargs):
+            if not self.running:
+                return handler(*args, **kwargs)
+            ident = threading.get_ident()
+            active = self.active
+            active[ident] = active.get(ident, 0) + 1
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                depth = active.get(ident, 1) - 1
+                if depth:
+                    active[ident] = depth
+                else:
+                    active.pop(ident, None)
+        return internal
+
+    def start(self) -> None:
+        with self.lock:
+            if self.running:
+                return
+            self.stacks = Counter()
+            self.samples = 0
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        logger.info("Profiling, stacks go to %s", self.path)
+
+    def stop(self) -> None:
+        with self.lock:
+            if not self.running:
+                return
+            self.running = False
+            thread = self.thread
+        assert thread is not None
+        thread.join()
+        self.dump()
+        logger.info("Stopped profiling after %s samples", self.samples)
+
+    def toggle(self) -> bool:
+        "Start or stop. Returns whether it runs now"
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+        return self.running
+
+    def run(self) -> None:
+        own = threading.get_ident()
+        next_dump = time.monotonic() + self.period
+        while self.running:
+            time.sleep(self.interval)
+            self.sample(own)
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.period
+
+    def sample(self, own : int) -> None:
+        frames = sys._current_frames()
+        if self.all_threads:
+            idents: Iterable[int] = frames.keys()
+        else:
+            idents = list(self.active)
+        for ident in idents:
+            frame = frames.get(ident)
+            if ident == own or frame is None:
+                continue
+            self.stacks[collapse(frame)] += 1
+            self.samples += 1
+
+    def dump(self) -> None:
+        stacks = list(self.stacks.items())
+        temp = self.path + ".tmp"
+        try:
+            with open(temp, "w") as f:
+                for stack, count in stacks:
+                    f.write(f"{stack} {count}\n")
+            os.replace(temp, self.path)
+        except OSError as e:
+            logger.warning("Could not write profile to %s: %s", self.path, e)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+from typing import *
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+import time
+import logging
+from metrics import Metrics
+from telegram.error import RetryAfter # type: ignore
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: keeping bot api calls within telegram limits. Telegram allows
+about 30 requests per second overall, about 20 messages per minute in a group
+and about one per second in a private chat. ApiScheduler wraps a bot and has
+the same methods for the calls this bot makes, but every call waits in a queue
+until the global token bucket allows it. Sending and editing messages also
+waits for the chat's token bucket. Deleting doesn't post anything to the chat,
+so it's only limited globally, otherwise cleaning up after a raid would take
+minutes.
+
+Calls waiting in queue are prioritised: deleting flood goes first, then edits
+of joined messages, then sending new ones. Within a priority chats take turns.
+When telegram still answers with RetryAfter, the call is put back to the
+front of its queue and the chat is paused for the advertised time.
+
+Calls block until they're done and return what the bot returned, so the
+scheduler can be given to DeletionQueue and EditCoalescer in place of a bot.
+"""
+
+logger = logging.getLogger(__name__)
+
+# priorities, smaller goes first
+Delete = 0
+Edit = 1
+Send = 2
+Priorities = [Delete, Edit, Send]
+
+GlobalRate = 30.0
+GroupRate = 20.0 / 60
+GroupBurst = 20.0
+PrivateRate = 1.0
+PrivateBurst = 3.0
+MaxRetries = 5
+
+
+class TokenBucket:
+    "Allows `rate` calls per second with bursts up to `capacity`"
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate : float, capacity : float, now : float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def refill(self, now : float) -> None:
+        if now > self.stamp:
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+
+    def try_take(self, now : float) -> bool:
+        self.refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now : float) -> float:
+        "How long until there is a token"
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def block(self, seconds : float, now : float) -> None:
+        "Give out no tokens for some time"
+        self.refill(now)
+        self.tokens = min(self.tokens, 1.0) - seconds * self.rate
+
+    def is_full(self, now : float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class Job:
+    __slots__ = ("chat_id", "priority", "method", "args", "kwargs"
+                ,"future", "submitted", "retries")
+
+    def __init__(self, chat_id : int, priority : int
+                     , method : Callable, args : tuple, kwargs : dict
+                ) -> None:
+        self.chat_id = chat_id
+        self.priority = priority
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.submitted = time.monotonic()
+        self.retries = 0
+
+
+class ApiScheduler:
+    "Rate limited, prioritised proxy of a bot"
+
+    def __init__(self, bot
+                     , global_rate : float = GlobalRate
+                     , group_rate : float = GroupRate
+                     , private_rate : float = PrivateRate
+                     , workers : int = 8
+                     , metrics : Optional[Metrics] = None
+                ) -> None:
+        self.bot = bot
+        self.metrics = metrics
+        self.group_rate = group_rate
+        self.private_rate = private_rate
+        now = time.monotonic()
+        self.global_bucket = TokenBucket(global_rate, global_rate, now)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        # for each priority: chat_id -> calls in order. Order of chats is the
+        # order they take turns in
+        self.waiting: List[Dict[int, Deque[Job]]] = [{} for _ in Priorities]
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.pool = ThreadPoolExecutor(workers)
+
+        # statistics
+        self.dispatched = 0
+        self.done = 0
+        self.retried = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+        if hasattr(bot, "delete_messages"):
+            self.delete_messages = self._delete_messages
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # the bot interface
+
+    def send_message(self, chat_id : int, text : str, **kwargs):
+        return self.call(chat_id, Send, self.bot.send_message
+                        , (), dict(chat_id=chat_id, text=text, **kwargs))
+
+    def edit_message_text(self, text : str, chat_id : int, message_id : int, **kwargs):
+        return self.call(chat_id, Edit, self.bot.edit_message_text
+                        , (), dict(text=text, chat_id=chat_id, message_id=message_id, **kwargs))
+
+    def delete_message(self, chat_id : int, message_id : int):
+        return self.call(chat_id, Delete, self.bot.delete_message
+                        , (chat_id, message_id), {})
+
+    def _delete_messages(self, chat_id : int, message_ids : List[int]):
+        return self.call(chat_id, Delete, self.bot.delete_messages
+                        , (chat_id, message_ids), {})
+
+    def call(self, chat_id : int, priority : int
+                 , method : Callable, args : tuple, kwargs : dict
+            ):
+        "Queue a call and wait for its result"
+        return self.submit(Job(chat_id, priority, method, args, kwargs)).result()
+
+    def submit(self, job : Job) -> Future:
+        with self.cond:
+            self.enqueue(job)
+            self.cond.notify()
+        return job.future
+
+    def enqueue(self, job : Job, front : bool = False) -> None:
+        chats = self.waiting[job.priority]
+        if job.chat_id not in chats:
+            chats[job.chat_id] = deque()
+        if front:
+            chats[job.chat_id].appendleft(job)
+        else:
+            chats[job.chat_id].append(job)
+
+    # dispatching
+
+    def run(self) -> None:
+        while True:
+            job = self.next_job()
+            if job is None:
+                return
+            self.pool.submit(self.execute, job)
+
+    def next_job(self) -> Optional[Job]:
+        "Wait until some call is allowed to go and take it"
+        with self.cond:
+            while not self.stopped:
+                now = time.monotonic()
+                wait = self.global_bucket.wait_time(now)
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+
+                job, wait = self.pick(now)
+                if job is not None:
+                    self.global_bucket.try_take(now)
+                    return job
+                self.cond.wait(wait)
+            return None
+
+    def pick(self, now : float) -> Tuple[Optional[Job], Optional[float]]:
+        "Take the most important allowed call, or tell how long to wait"
+        wait: Optional[float] = None
+        for priority, chats in enumerate(self.waiting):
+            for chat_id, jobs in chats.items():
+                if priority != Delete:
+                    bucket = self.bucket(chat_id, now)
+                    if not bucket.try_take(now):
+                        chat_wait = bucket.wait_time(now)
+                        if wait is None or chat_wait < wait:
+                            wait = chat_wait
+                        continue
+                job = jobs.popleft()
+                # the chat goes to the end of the line
+                del chats[chat_id]
+                if jobs:
+                    chats[chat_id] = jobs
+                self.account(job, now)
+                return job, None
+        self.forget_idle(now)
+        return None, wait
+
+    def bucket(self, chat_id : int, now : float) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            # negative ids are groups and channels
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, GroupBurst, now)
+            else:
+                bucket = TokenBucket(self.private_rate, PrivateBurst, now)
+            self.chat_buckets[chat_id] = bucket
+        return self.chat_buckets[chat_id]
+
+    def forget_idle(self, now : float) -> None:
+        "Full buckets of chats without calls are the same as new ones"
+        if len(self.chat_buckets) < 1024:
+            return
+        busy = set()
+        for chats in self.waiting:
+            busy.update(chats.keys())
+        self.chat_buckets = {c: b for c, b in self.chat_buckets.items()
+                                  if c in busy or not b.is_full(now)}
+
+    def account(self, job : Job, now : float) -> None:
+        wait = now - job.submitted
+        self.dispatched += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def execute(self, job : Job) -> None:
+        start = time.perf_counter()
+        try:
+            result = job.method(*job.args, **job.kwargs)
+        except RetryAfter as e:
+            self.measure(job, start, e)
+            self.retry(job, e.retry_after)
+            return
+        except Exception as e:
+            self.measure(job, start, e)
+            self.finish()
+            job.future.set_exception(e)
+            return
+        self.measure(job, start, None)
+        self.finish()
+        job.future.set_result(result)
+
+    def measure(self, job : Job, start : float, error : Optional[Exception]) -> None:
+        metrics = self.metrics
+        if metrics is None:
+            return
+        method = job.method.__name__
+        metrics.histogram("joinbot_api_seconds", "Time of bot api calls"
+                         ,method=method).observe(time.perf_counter() - start)
+        if error is not None:
+            metrics.counter("joinbot_api_failures_total", "Failed bot api calls"
+                           ,method=method, error=type(error).__name__).inc()
+
+    def retry(self, job : Job, delay : float) -> None:
+        job.retries += 1
+        with self.cond:
+            self.retried += 1
+            if job.retries > MaxRetries:
+                self.done += 1
+                job.future.set_exception(RuntimeError(f"Gave up after {MaxRetries} retries"))
+                return
+            logger.info("Chat %s is rate limited for %s seconds", job.chat_id, delay)
+            now = time.monotonic()
+            self.bucket(job.chat_id, now).block(delay, now)
+            self.enqueue(job, front=True)
+            self.cond.notify()
+
+    def finish(self) -> None:
+        with self.cond:
+            self.done += 1
+
+    def stats(self) -> Dict[str, float]:
+        "Queue depth and waiting time, for sizing deployments"
+        with self.cond:
+            depth = [sum(map(len, chats.values())) for chats in self.waiting]
+            dispatched = self.dispatched
+            return { "queued_delete": depth[Delete]
+                   , "queued_edit":   depth[Edit]
+                   , "queued_send":   depth[Send]
+                   , "done":          self.done
+                   , "retried":       self.retried
+                   , "mean_wait":     self.total_wait / dispatched if dispatched else 0.0
+                   , "max_wait":      self.max_wait
+                   }
+
+    def stop(self) -> None:
+        "Stop dispatching. Calls still in queue are cancelled"
+        with self.cond:
+            self.stopped = True
+            self.cond.notify()
+        self.thread.join()
+        self.pool.shutdown()
+        with self.cond:
+            for chats in self.waiting:
+                for jobs in chats.values():
+                    for job in jobs:
+                        job.future.cancel()
+                chats.clear()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+from typing import *
+from datetime import datetime
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: a compact record of a telegram message. Counters keep many
+recent messages around, and joiner keeps them until the joined message is
+sent, but they only need a couple of fields out of each one. A snapshot takes
+those fields once when the message arrives, and the rest of the message can be
+garbage collected.
+
+The user object is kept by reference: it's only needed for the name and link
+when the joined message is built, which is rare.
+"""
+
+
+# fields of a message that are only present when it's forwarded
+ForwardFields = ( "forward_from"
+                , "forward_from_chat"
+                , "forward_from_message_id"
+                , "forward_signature"
+                , "forward_date"
+                )
+
+def is_forwarded(msg) -> bool:
+    return ( msg.forward_from != None
+          or msg.forward_from_chat != None
+          or msg.forward_from_message_id != None
+          or msg.forward_signature != None
+          or msg.forward_date != None
+           )
+
+
+class UserRef:
+    "Just enough of a telegram user to sign a joined message"
+    __slots__ = ("id", "full_name", "link")
+
+    def __init__(self, id : int, full_name : str, link : Optional[str]) -> None:
+        self.id = id
+        self.full_name = full_name
+        self.link = link
+
+    @staticmethod
+    def from_json(data : dict) -> 'UserRef':
+        "Make from a User object of bot api json"
+        full_name = data.get("first_name", "")
+        if data.get("last_name"):
+            full_name += " " + data["last_name"]
+        username = data.get("username")
+        link = f"https://t.me/{username}" if username else None
+        return UserRef(data["id"], full_name, link)
+
+
+class MessageSnapshot:
+    "Fields of a telegram message used by counters and joiner"
+    __slots__ = ( "chat_id"
+                , "message_id"
+                , "from_id"
+                , "user"
+                , "date"
+                , "text"
+                , "reply_to_id"
+                , "forwarded"
+                , "content_key"
+                )
+
+    def __init__(self, chat_id : int
+                     , message_id : Optional[int]
+                     , user
+                     , date : datetime
+                     , text : Optional[str]
+                     , reply_to_id : Optional[int] = None
+                     , forwarded : bool = False
+                ) -> None:
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.from_id = user.id if user is not None else None
+        self.user = user
+        self.date = date
+        self.text = text
+        self.reply_to_id = reply_to_id
+        self.forwarded = forwarded
+        # set by the content counter, see content.py
+        self.content_key: Optional[int] = None
+
+    @staticmethod
+    def of(message) -> 'MessageSnapshot':
+        "Take a snapshot of a telegram message. Snapshots are returned as is"
+        if isinstance(message, MessageSnapshot):
+            return message
+        reply_to = message.reply_to_message
+        return MessageSnapshot(
+                message.chat.id
+                ,message.message_id
+                ,message.from_user
+                ,message.date
+                ,message.text
+                ,reply_to.message_id if reply_to is not None else None
+                ,is_forwarded(message)
+                )
+
+    @staticmethod
+    def from_json(data : dict) -> 'MessageSnapshot':
+        "Make from a Message object of bot api json, without parsing the rest"
+        reply_to = data.get("reply_to_message")
+        sender = data.get("from")
+        return MessageSnapshot(
+                data["chat"]["id"]
+                ,data["message_id"]
+                ,UserRef.from_json(sender) if sender is not None else None
+                ,datetime.utcfromtimestamp(data["date"])
+                ,data.get("text")
+                ,reply_to["message_id"] if reply_to is not None else None
+                ,any(field in data for field in ForwardFields)
+                )
+
+    def __repr__(self) -> str:
+        return (f"MessageSnapshot(chat_id={self.chat_id}"
+                f", message_id={self.message_id}, from_id={self.from_id}"
+                f", date={self.date!r}, text={self.text!r})")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+from typing import *
+from datetime import datetime, timedelta
+from abc import ABC, abstractmethod
+import marshal
+import sqlite3
+import time
+import logic
+import join
+import persist
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: where counters and joiner keep their tables. A store makes named
+tables that behave like dicts. MemoryStore gives out plain dicts, which is the
+fastest and what a single bot process wants.
+
+SqliteStore keeps the tables in a local sqlite database in WAL mode, so that
+several bot processes on one machine can share them, and a restarted process
+finds its state where it was left. Writes are collected and committed in
+batches: a value that changes many times between commits is written once.
+Until a batch is committed other processes don't see it, so a chat should
+always be handled by the same process, see workers.py. Every key of these
+tables starts with a chat id, which is a column of its own.
+
+Statuses are stored together with their deadline, and rows that expired
+long ago are purged when a table is opened and on commit. Counters evict what they know of themselves,
+this is for statuses left behind by a process that was stopped.
+"""
+
+
+# rows with deadlines this long ago are purged. Updates can wait for the bot
+# as long as this, so statuses are never purged before they could be used
+Retention = timedelta(days=1)
+
+
+class Codec(ABC):
+    "How values of a table are stored"
+    @staticmethod
+    @abstractmethod
+    def encode(value) -> Tuple[Optional[float], bytes]:
+        "Returns the deadline of the value, if any, and its bytes"
+        ...
+    @staticmethod
+    @abstractmethod
+    def decode(data : bytes) -> Any:
+        ...
+
+
+class StatusCodec(Codec):
+    "Counter statuses with their messages"
+    @staticmethod
+    def encode(status : logic.AbstractStatus) -> Tuple[Optional[float], bytes]:
+        encoder = persist.Encoder()
+        data = encoder.status(status)
+        return persist.to_timestamp(status.deadline()), marshal.dumps((encoder.users, data))
+
+    @staticmethod
+    def decode(data : bytes) -> logic.AbstractStatus:
+        users, status = marshal.loads(data)
+        return persist.Decoder(users).status(status)
+
+
+class InfoCodec(Codec):
+    "Joined messages of the joiner"
+    @staticmethod
+    def encode(info : join.MessageInfo) -> Tuple[Optional[float], bytes]:
+        return None, marshal.dumps((info.message_id, list(info.text.lines)))
+
+    @staticmethod
+    def decode(data : bytes) -> join.MessageInfo:
+        message_id, lines = marshal.loads(data)
+        return join.MessageInfo(message_id, join.TextBuffer(lines))
+
+
+class StateStore(ABC):
+    "Makes tables for counters and joiner"
+
+    @abstractmethod
+    def table(self, name : str, key_type : Callable, codec : Type[Codec]) -> MutableMapping:
+        ...
+
+    def flush(self) -> None:
+        "Make all changes visible to other processes"
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+
+class MemoryStore(StateStore):
+    "Tables are plain dicts, nothing is shared or saved"
+
+    def table(self, name : str, key_type : Callable, codec : Type[Codec]) -> MutableMapping:
+        return {}
+
+
+# marks a pending deletion
+Deleted = object()
+
+
+class SqliteTable(MutableMapping):
+    "A table of SqliteStore. Changes are kept here until the store commits"
+
+    def __init__(self, store : 'SqliteStore', name : str
+                     , key_type : Callable, codec : Type[Codec]
+                ) -> None:
+        self.store = store
+        self.name = name
+        self.key_type = key_type
+        self.codec = codec
+        self.pending: Dict[Any, Any] = {}
+        store.db.execute(f"""CREATE TABLE IF NOT EXISTS {name}
+                             ( chat_id INTEGER NOT NULL
+                             , key NOT NULL
+                             , deadline REAL
+                             , data BLOB NOT NULL
+                             , PRIMARY KEY (chat_id, key)
+                             ) WITHOUT ROWID""")
+        store.db.execute(f"CREATE INDEX IF NOT EXISTS {name}_deadline ON {name} (deadline)")
+        self.select = f"SELECT data FROM {name} WHERE chat_id = ? AND key = ?"
+        self.exists = f"SELECT 1 FROM {name} WHERE chat_id = ? AND key = ?"
+
+    def __getitem__(self, key):
+        value = self.pending.get(key)
+        if value is Deleted:
+            raise KeyError(key)
+        if value is not None:
+            return value
+        row = self.store.db.execute(self.select, tuple(key)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.codec.decode(row[0])
+
+    def __contains__(self, key) -> bool:
+        value = self.pending.get(key)
+        if value is not None:
+            return value is not Deleted
+        return self.store.db.execute(self.exists, tuple(key)).fetchone() is not None
+
+    def __setitem__(self, key, value) -> None:
+        # encoded only on commit, so that it's done once for many changes
+        self.pending[key] = value
+        self.store.changed()
+
+    def __delitem__(self, key) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self.pending[key] = Deleted
+        self.store.changed()
+
+    def __iter__(self) -> Iterator:
+        self.store.flush()
+        key_type = self.key_type
+        rows = self.store.db.execute(f"SELECT chat_id, key FROM {self.name}").fetchall()
+        return (key_type(*row) for row in rows)
+
+    def __len__(self) -> int:
+        self.store.flush()
+        return self.store.db.execute(f"SELECT count(*) FROM {self.name}").fetchone()[0]
+
+    def write(self, db : sqlite3.Connection) -> None:
+        "Write pending changes, the store commits them"
+        if not self.pending:
+            return
+        encode = self.codec.encode
+        updates = []
+        deletes = []
+        for key, value in self.pending.items():
+            if value is Deleted:
+                deletes.append(tuple(key))
+            else:
+                deadline, data = encode(value)
+                updates.append((*key, deadline, data))
+        db.executemany(f"INSERT OR REPLACE INTO {self.name} VALUES (?, ?, ?, ?)", updates)
+        db.executemany(f"DELETE FROM {self.name} WHERE chat_id = ? AND key = ?", deletes)
+        self.pending.clear()
+
+    def purge(self, db : sqlite3.Connection, until : float) -> None:
+        db.execute(f"DELETE FROM {self.name} WHERE deadline < ?", (until,))
+
+
+class SqliteStore(StateStore):
+    "Tables in a sqlite database shared between processes"
+
+    def __init__(self, path : str
+                     , batch : int = 500
+                     , interval : float = 0.5
+                ) -> None:
+        # the pipeline lock guards the tables, and it's taken by more than
+        # one thread
+        self.db = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        # in WAL mode this is still safe from corruption, only the latest
+        # commits may be lost on power failure
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("PRAGMA busy_timeout = 5000")
+        self.tables: List[SqliteTable] = []
+        # commit after this many changes or this many seconds
+        self.batch = batch
+        self.interval = interval
+        self.changes = 0
+        self.last_commit = time.monotonic()
+        self.commits = 0
+
+    def table(self, name : str, key_type : Callable, codec : Type[Codec]) -> MutableMapping:
+        table = SqliteTable(self, name, key_type, codec)
+        table.purge(self.db, self.purge_until())
+        self.tables.append(table)
+        return table
+
+    def purge_until(self) -> float:
+        return persist.to_timestamp(datetime.utcnow() - Retention)
+
+    def changed(self) -> None:
+        self.changes += 1
+        if (self.changes >= self.batch
+                or time.monotonic() - self.last_commit >= self.interval):
+            self.flush()
+
+    def flush(self) -> None:
+        self.last_commit = time.monotonic()
+        if self.changes == 0:
+            return
+        db = self.db
+        until = self.purge_until()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for table in self.tables:
+                table.write(db)
+                table.purge(db, until)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self.changes = 0
+        self.commits += 1
+
+    def close(self) -> None:
+        self.flush()
+        self.db.close()
+
+
+def make_counter(store : StateStore) -> logic.MessageCounter:
+    return logic.FusedMessageCounter(
+            logic.UserMessageCounter(store.table("user_statuses", logic.UID, StatusCodec))
+            ,logic.ContentMessageCounter(store.table("content_statuses", logic.MsgID, StatusCodec))
+            ,logic.ReplyMessageCounter(store.table("reply_statuses", logic.ReplyID, StatusCodec))
+            ,logic.RaidMessageCounter(store.table("chat_activity", logic.ChatID, StatusCodec))
+            )
+
+
+def make_joiner(store : StateStore) -> join.Joiner:
+    return join.Joiner( store.table("user_bases", join.UID, InfoCodec)
+                      , store.table("content_bases", join.BodyID, InfoCodec)
+                      , store.table("reply_bases", join.MsgID, InfoCodec)
+                      , store.table("raid_bases", join.RaidID, InfoCodec)
+                      )
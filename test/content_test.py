@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import join
+from content import normalize, content_key, NearDuplicates
+from snapshot import MessageSnapshot, UserRef
+from test.fakebot import FakeBot
+import unittest
+from typing import *
+
+import random
+from datetime import datetime, timedelta
+
+def said(user_id : int, text : str, time : datetime) -> MessageSnapshot:
+    user = UserRef(user_id, f"user {user_id}", None)
+    return MessageSnapshot(-1, random.randint(0, 1<<31), user, time, text)
+
+Spam = "Buy cheap followers for your channel at example dot com, best prices today"
+
+def variant(i : int) -> str:
+    "The spam with a small change, like waves of copy-paste spam have"
+    words = Spam.split()
+    words[i % len(words)] = words[i % len(words)].upper() + "!"
+    return " ".join(words) + f" {i}"
+
+
+class TestNormalize(unittest.TestCase):
+
+    def test_same_content(self):
+        self.assertEqual(normalize("lol"), "lol")
+        self.assertEqual(normalize("LOL"), "lol")
+        self.assertEqual(normalize("  lol!! "), "lol")
+        self.assertEqual(normalize("hello,\n  world..."), "hello world")
+        self.assertEqual(normalize("«Привет», мир"), "привет мир")
+        self.assertEqual(content_key("Hello, World!"), content_key("hello world"))
+
+    def test_keeps_emoji_and_symbols(self):
+        self.assertEqual(normalize("nice 👍👍!"), "nice 👍👍")
+        self.assertNotEqual(content_key("nice 👍"), content_key("nice"))
+        self.assertNotEqual(content_key("+1"), content_key("1"))
+
+    def test_only_punctuation(self):
+        self.assertEqual(normalize(" ??? "), "???")
+        self.assertNotEqual(content_key("???"), content_key("!!!"))
+
+
+class TestContentCounter(unittest.TestCase):
+
+    def test_unites_long_texts(self):
+        counter = logic.ContentMessageCounter({})
+        time = datetime.utcnow()
+        text = "a long text " * 50
+        for user in range(1, logic.MessageThreshold + 1):
+            r = counter.decide(said(user, text if user % 2 else text.upper(), time))
+        self.assertIsInstance(r, logic.UniteMessagesContent)
+        self.assertEqual(len(r.messages), logic.MessageThreshold)
+        # only the hash is in the key
+        (key,) = counter.msg_queue
+        self.assertIsInstance(key.content, int)
+
+    def test_exact_mode_keeps_variants_apart(self):
+        counter = logic.ContentMessageCounter({})
+        time = datetime.utcnow()
+        for i in range(logic.MessageThreshold * 2):
+            r = counter.decide(said(i + 1, variant(i), time))
+            self.assertIsInstance(r, logic.DoNothing)
+
+    def test_near_duplicates(self):
+        counter = logic.ContentMessageCounter({}, NearDuplicates())
+        time = datetime.utcnow()
+        for i in range(logic.MessageThreshold):
+            r = counter.decide(said(i + 1, variant(i), time))
+        self.assertIsInstance(r, logic.UniteMessagesContent)
+
+        # something else entirely is counted apart
+        r = counter.decide(said(100, "Meeting moved to thursday, bring the slides", time))
+        self.assertIsInstance(r, logic.DoNothing)
+        self.assertEqual(len(counter.msg_queue), 2)
+
+    def test_joiner_finds_variants(self):
+        counter = logic.ContentMessageCounter({}, NearDuplicates())
+        joiner = join.Joiner()
+        bot = FakeBot()
+        time = datetime.utcnow()
+        for i in range(logic.MessageThreshold):
+            msg = said(i + 1, variant(i), time)
+            r = counter.decide(msg)
+        action = joiner.unite_content(r.messages)
+        self.assertIsInstance(action, join.SendMessage)
+        joiner.sent_message(msg, bot.send_message(-1, action.text))
+
+        msg = said(50, variant(50), time)
+        r = counter.decide(msg)
+        action = joiner.unite_content(r.messages)
+        self.assertIsInstance(action, join.EditMessage)
+
+
+class TestNearDuplicates(unittest.TestCase):
+
+    def test_bounded(self):
+        near = NearDuplicates(capacity=100)
+        rand = random.Random(0)
+        letters = "abcdefghijklmnopqrstuvwxyz "
+        for i in range(1000):
+            near.key(-1, "".join(rand.choice(letters) for _ in range(40)))
+        self.assertEqual(len(near), 100)
+        # every bucket points to a remembered text
+        remembered = {key for _, key in near.signatures}
+        self.assertTrue(set(near.buckets.values()) <= remembered)
+
+    def test_chats_apart(self):
+        near = NearDuplicates()
+        a = near.key(-1, Spam)
+        b = near.key(-2, variant(3))
+        self.assertNotEqual(a, b)
+        self.assertEqual(near.key(-2, variant(4)), b)
+
+    def test_short_texts(self):
+        near = NearDuplicates()
+        self.assertEqual(near.key(-1, "ok"), content_key("OK!"))
+        self.assertNotEqual(near.key(-1, "okay"), near.key(-1, "okey dokey"))
+
+
+if __name__ == '__main__':
+    unittest.main()
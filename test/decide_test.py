@@ -6,12 +6,15 @@ License: published under GNU GPL-3
 """
 
 import logic
+from snapshot import MessageSnapshot, UserRef
+from content import content_key
 import unittest
 from typing import *
 
 import random
 from datetime import datetime, timedelta
 from copy import deepcopy
+from timeit import default_timer as timer
 
 def rand_time(delta : int) -> datetime:
     seconds = random.randint(0, delta)
@@ -26,6 +29,7 @@ class SimpleMessage:
         self.chat = SimpleMessage.HasId(chat_id)
         self.from_user = SimpleMessage.HasId(user_id)
         self.date = time
+        self.message_id = random.randint(0, 1<<31)
         self.reply_to_message = None # TODO
         self.text = "some text"
 
@@ -94,5 +98,174 @@ class TestDecide(unittest.TestCase):
             msg.date += logic.DelayDelete * 0.25
 
 
+class TestExpiry(unittest.TestCase):
+
+    def test_forgets_idle_users(self):
+        counter = logic.UserMessageCounter({})
+
+        msg = SimpleMessage.gen()
+        counter.decide(msg)
+        self.assertEqual(len(counter.msg_queue), 1)
+
+        # another user posts long after
+        msg.from_user.id += 1
+        msg.date += logic.DelayDelete + timedelta(seconds=2)
+        counter.decide(msg)
+        self.assertEqual(len(counter.msg_queue), 1)
+        self.assertEqual(counter.expiry.evictions, 1)
+
+    def test_keeps_strict_until_release(self):
+        counter = logic.UserMessageCounter({})
+
+        msg = SimpleMessage.gen()
+        for _ in range(logic.MessageThreshold + 1):
+            r = counter.decide(msg)
+            msg.date += timedelta(seconds=1)
+        self.assertIsInstance(r, logic.JoinUserMessages)
+        strict_user = logic.UID(msg.chat.id, msg.from_user.id)
+        stop_time = counter.msg_queue[strict_user].stop_time
+
+        other = SimpleMessage.gen()
+        other.date = stop_time
+        counter.decide(other)
+        self.assertIn(strict_user, counter.msg_queue)
+
+        other.date = stop_time + timedelta(seconds=2)
+        counter.decide(other)
+        self.assertNotIn(strict_user, counter.msg_queue)
+
+    def test_table_stays_bounded(self):
+        counter = logic.MessageCounter()
+        for c in counter.counters:
+            c.msg_queue.clear()
+
+        time = datetime.utcnow()
+        for i in range(1000):
+            msg = SimpleMessage(1, i, time)
+            msg.text = str(i)
+            counter.decide(msg)
+            time += timedelta(seconds=1)
+
+        window = logic.ExpiryHorizon.total_seconds() + 2
+        self.assertLessEqual(counter.live_entries(), 2 * window)
+        self.assertGreater(counter.evictions(), 0)
+
+
+def reply(user_id : int, reply_to_id : int, time : datetime) -> MessageSnapshot:
+    user = UserRef(user_id, f"user {user_id}", None)
+    return MessageSnapshot(-1, random.randint(0, 1<<31), user, time, "+1", reply_to_id)
+
+class TestReply(unittest.TestCase):
+
+    def test_unites_replies(self):
+        counter = logic.ReplyMessageCounter({})
+        time = datetime.utcnow()
+        for user in range(1, logic.MessageThreshold + 1):
+            r = counter.decide(reply(user, 42, time))
+            time += timedelta(seconds=1)
+        self.assertIsInstance(r, logic.UniteMessagesReply)
+        self.assertEqual(len(r.messages), logic.MessageThreshold)
+
+        r = counter.decide(reply(100, 42, time))
+        self.assertIsInstance(r, logic.UniteMessagesReply)
+        self.assertEqual(len(r.messages), 1)
+
+        # replies to other messages are counted apart
+        r = counter.decide(reply(100, 43, time))
+        self.assertIsInstance(r, logic.DoNothing)
+
+    def test_ignores_non_replies(self):
+        counter = logic.ReplyMessageCounter({})
+        msg = SimpleMessage.gen()
+        for _ in range(logic.MessageThreshold + 1):
+            self.assertIsInstance(counter.decide(msg), logic.DoNothing)
+        self.assertEqual(len(counter.msg_queue), 0)
+
+    def test_hot_target_constant_cost(self):
+        counter = logic.ReplyMessageCounter({})
+        time = datetime.utcnow()
+        replies = 5000
+        # a few replies per second, all from different users
+        messages = [reply(i + 1, 42, time + timedelta(milliseconds=250 * i))
+                    for i in range(replies)]
+
+        durations = []
+        for start in range(0, replies, 500):
+            began = timer()
+            for msg in messages[start : start + 500]:
+                r = counter.decide(msg)
+            durations.append(timer() - began)
+            self.assertIsInstance(r, logic.UniteMessagesReply)
+            self.assertEqual(len(r.messages), 1)
+            # one status for the target, and the wheel only keeps about an
+            # entry per second of it
+            self.assertEqual(len(counter.msg_queue), 1)
+            self.assertLessEqual(len(counter.expiry), counter.expiry.size + 1)
+
+        # the last replies don't cost more than the first ones
+        self.assertLess(min(durations[-3:]), 3 * min(durations[1:4]))
+
+
+def fresh_fused() -> logic.FusedMessageCounter:
+    return logic.FusedMessageCounter( logic.UserMessageCounter({})
+                                    , logic.ContentMessageCounter({})
+                                    , logic.ReplyMessageCounter({})
+                                    )
+
+def fresh_chain() -> logic.MessageCounter:
+    return logic.MessageCounter([ logic.UserMessageCounter({})
+                                , logic.ContentMessageCounter({})
+                                , logic.ReplyMessageCounter({})
+                                ])
+
+def said(user_id : int, text : str, time : datetime) -> MessageSnapshot:
+    user = UserRef(user_id, f"user {user_id}", None)
+    return MessageSnapshot(-1, random.randint(0, 1<<31), user, time, text)
+
+class TestFused(unittest.TestCase):
+
+    def test_same_as_chain_for_users(self):
+        fused = fresh_fused()
+        chain = fresh_chain()
+        time = datetime.utcnow()
+        for i in range(500):
+            msg = said(random.randint(1, 5), f"text {i}", time)
+            a = fused.decide(msg)
+            b = chain.decide(msg)
+            self.assertIs(type(a), type(b))
+            if not isinstance(a, logic.DoNothing):
+                self.assertEqual(a.messages, b.messages)
+            time += timedelta(seconds=random.choice([0, 1, 3]))
+
+    def test_user_goes_first(self):
+        counter = fresh_fused()
+        time = datetime.utcnow()
+        for _ in range(logic.MessageThreshold):
+            r = counter.decide(said(1, "spam", time))
+        # both the user and the content switched, the user wins
+        self.assertIsInstance(r, logic.JoinUserMessages)
+        self.assertTrue(counter.content.msg_queue[logic.MsgID(-1, content_key("spam"))].is_strict())
+
+    def test_all_windows_count(self):
+        fused = fresh_fused()
+        chain = fresh_chain()
+        time = datetime.utcnow()
+        for _ in range(logic.MessageThreshold + 1):
+            msg = said(1, "spam", time)
+            fused.decide(msg)
+            chain.decide(msg)
+
+        # another user posts the same. The chain content counter missed the
+        # end of the flood, and unites messages that were already joined
+        msg = said(2, "spam", time)
+        r = chain.decide(msg)
+        self.assertIsInstance(r, logic.UniteMessagesContent)
+        self.assertEqual(len(r.messages), logic.MessageThreshold)
+        # the fused one has seen it all, and only this message is new
+        r = fused.decide(msg)
+        self.assertIsInstance(r, logic.UniteMessagesContent)
+        self.assertEqual(r.messages, [msg])
+
+
 if __name__ == '__main__':
     unittest.main()
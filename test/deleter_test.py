@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+from deleter import DeletionQueue
+from test.fakebot import FakeBot, FakeBulkBot
+import unittest
+from typing import *
+
+import time
+
+class TestDeletionQueue(unittest.TestCase):
+
+    def test_bulk_burst_is_one_request(self):
+        bot = FakeBulkBot()
+        queue = DeletionQueue(bot, window=0.05)
+        for message_id in range(5):
+            queue.delete(1, message_id)
+        time.sleep(0.2)
+
+        self.assertEqual(bot.round_trips(), 1)
+        self.assertEqual(bot.calls[0], ("delete_messages", (1, (0, 1, 2, 3, 4))))
+        queue.stop()
+
+    def test_chats_are_separate(self):
+        bot = FakeBulkBot()
+        queue = DeletionQueue(bot, window=10)
+        for message_id in range(3):
+            queue.delete(1, message_id)
+            queue.delete(2, message_id)
+        queue.stop()
+
+        self.assertEqual(bot.counts["delete_messages"], 2)
+        self.assertEqual(queue.deleted, 6)
+
+    def test_large_batch_is_split(self):
+        bot = FakeBulkBot()
+        queue = DeletionQueue(bot, window=10)
+        for message_id in range(250):
+            queue.delete(1, message_id)
+        queue.stop()
+
+        self.assertEqual(bot.round_trips(), 3)
+
+    def test_duplicates_are_coalesced(self):
+        bot = FakeBot()
+        queue = DeletionQueue(bot, window=10)
+        # user and content counters may both ask to delete a message
+        for _ in range(2):
+            for message_id in range(5):
+                queue.delete(1, message_id)
+        queue.stop()
+
+        self.assertEqual(bot.round_trips(), 5)
+
+    def test_fan_out_is_concurrent(self):
+        latency = 0.1
+        bot = FakeBot(latency=latency)
+        queue = DeletionQueue(bot, window=10, workers=5)
+        for message_id in range(5):
+            queue.delete(1, message_id)
+
+        start = time.monotonic()
+        queue.stop()
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(bot.counts["delete_message"], 5)
+        self.assertLess(elapsed, latency * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
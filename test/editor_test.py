@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+from editor import EditCoalescer
+from join import EditMessage
+from test.fakebot import FakeBot
+import unittest
+from typing import *
+
+import time
+
+class TestEditCoalescer(unittest.TestCase):
+
+    def test_first_edit_is_immediate(self):
+        bot = FakeBot()
+        editor = EditCoalescer(bot, interval=10)
+        editor.edit(EditMessage(1, 2, "text"))
+        time.sleep(0.1)
+
+        self.assertEqual(bot.calls, [("edit_message_text", (1, 2, "text"))])
+        editor.stop()
+
+    def test_burst_sends_latest(self):
+        bot = FakeBot()
+        editor = EditCoalescer(bot, interval=0.2)
+        for i in range(10):
+            editor.edit(EditMessage(1, 2, f"text {i}"))
+            time.sleep(0.01)
+        time.sleep(0.4)
+
+        self.assertEqual(bot.counts["edit_message_text"], 2)
+        self.assertEqual(bot.calls[-1], ("edit_message_text", (1, 2, "text 9")))
+        self.assertEqual(editor.requested, 10)
+        self.assertEqual(editor.saved, 8)
+        editor.stop()
+
+    def test_messages_are_separate(self):
+        bot = FakeBot()
+        editor = EditCoalescer(bot, interval=10)
+        editor.edit(EditMessage(1, 2, "a"))
+        editor.edit(EditMessage(1, 3, "b"))
+        editor.edit(EditMessage(4, 2, "c"))
+        editor.stop()
+
+        self.assertEqual(bot.round_trips(), 3)
+        self.assertEqual(editor.saved, 0)
+
+    def test_stop_flushes(self):
+        bot = FakeBot()
+        editor = EditCoalescer(bot, interval=10)
+        editor.edit(EditMessage(1, 2, "a"))
+        time.sleep(0.1)
+        editor.edit(EditMessage(1, 2, "b"))
+        editor.stop()
+
+        self.assertEqual(bot.calls[-1], ("edit_message_text", (1, 2, "b")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: a stand-in for telegram.Bot that doesn't go to the network. It
+records every call, can pretend that each request takes some time, and hands
+out message ids for sent messages. Used in tests and benchmarks.
+"""
+
+from typing import *
+from collections import Counter
+import itertools
+import threading
+import time
+
+
+class FakeBot:
+    class SentMessage:
+        def __init__(self, chat_id : int, message_id : int, text : str) -> None:
+            self.chat_id = chat_id
+            self.message_id = message_id
+            self.text = text
+
+    def __init__(self, latency : float = 0.0) -> None:
+        self.latency = latency
+        self.calls: List[Tuple[str, tuple]] = []
+        self.counts: Counter = Counter()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+    def request(self, method : str, *args) -> None:
+        "Pretend to make an http request"
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.calls.append((method, args))
+            self.counts[method] += 1
+
+    def round_trips(self) -> int:
+        return len(self.calls)
+
+    def send_message(self, chat_id : int, text : str, **kwargs) -> 'FakeBot.SentMessage':
+        self.request("send_message", chat_id, text)
+        with self.lock:
+            message_id = next(self.ids)
+        return FakeBot.SentMessage(chat_id, message_id, text)
+
+    def edit_message_text(self, text : str, chat_id : int, message_id : int, **kwargs) -> None:
+        self.request("edit_message_text", chat_id, message_id, text)
+
+    def delete_message(self, chat_id : int, message_id : int) -> None:
+        self.request("delete_message", chat_id, message_id)
+
+
+class FakeBulkBot(FakeBot):
+    "Fake of a bot that can delete many messages in one request"
+
+    def delete_messages(self, chat_id : int, message_ids : List[int]) -> None:
+        self.request("delete_messages", chat_id, tuple(message_ids))
@@ -7,10 +7,12 @@ License: published under GNU GPL-3
 
 import join
 import unittest
+from snapshot import MessageSnapshot
 from typing import *
 
 import random
 from copy import deepcopy
+from datetime import datetime
 
 class SimpleMessage:
     class HasId:
@@ -32,8 +34,15 @@ class SimpleMessage:
         self.from_user = SimpleMessage.HasIdName(user_id, name)
         self.text = text
         self.message_id = message_id
+        self.date = datetime.utcnow()
         self.reply_to_message = None # TODO
 
+        self.forward_from = None
+        self.forward_from_chat = None
+        self.forward_from_message_id = None
+        self.forward_signature = None
+        self.forward_date = None
+
     @staticmethod
     def gen() -> 'SimpleMessage':
         chat_id = random.randint(0, 1<<63)
@@ -43,21 +52,25 @@ class SimpleMessage:
         name = "mcnamelton"
         return SimpleMessage(chat_id, user_id, time, message_id, name)
 
+    @staticmethod
+    def gen_snapshot() -> MessageSnapshot:
+        return MessageSnapshot.of(SimpleMessage.gen())
+
 
 class TestJoin(unittest.TestCase):
 
     def test_first_join_sends(self):
         joiner = join.Joiner()
-        msg = SimpleMessage.gen()
+        msg = SimpleMessage.gen_snapshot()
 
         r = joiner.join([msg] * 4)
         self.assertIsInstance(r, join.SendMessage)
 
     def test_keeps_base(self):
         joiner = join.Joiner()
-        msg = SimpleMessage.gen()
+        msg = SimpleMessage.gen_snapshot()
         sent_msg = SimpleMessage.gen()
-        sent_msg.chat.id = msg.chat.id
+        sent_msg.chat.id = msg.chat_id
 
         r = joiner.join([msg]*4)
         self.assertIsInstance(r, join.SendMessage)
@@ -69,11 +82,11 @@ class TestJoin(unittest.TestCase):
 
     def test_resets_base(self):
         joiner = join.Joiner()
-        msg = SimpleMessage.gen()
+        msg = SimpleMessage.gen_snapshot()
         sent_msg1 = SimpleMessage.gen()
         sent_msg2 = SimpleMessage.gen()
-        sent_msg1.chat.id = msg.chat.id
-        sent_msg2.chat.id = msg.chat.id
+        sent_msg1.chat.id = msg.chat_id
+        sent_msg2.chat.id = msg.chat_id
 
         r = joiner.join([msg]*4)
         self.assertIsInstance(r, join.SendMessage)
@@ -88,6 +101,83 @@ class TestJoin(unittest.TestCase):
         self.assertIsInstance(r, join.EditMessage)
         self.assertEqual(sent_msg2.message_id, r.message_id)
 
+    def test_edit_appends_lines(self):
+        joiner = join.Joiner()
+        msg = SimpleMessage.gen_snapshot()
+        sent_msg = SimpleMessage.gen()
+
+        r = joiner.join([msg]*2)
+        first = r.text
+        joiner.sent_message(msg, sent_msg)
+        r = joiner.join([msg])
+
+        self.assertEqual(r.text, first + "\n" + msg.text)
+        self.assertEqual(first.count("\n"), 2)
+
+    def test_rolls_over_long_text(self):
+        joiner = join.Joiner()
+        msg = SimpleMessage.gen_snapshot()
+        msg.text = "a" * 1000
+        sent_msg1 = SimpleMessage.gen()
+        sent_msg2 = SimpleMessage.gen()
+
+        r = joiner.join([msg] * 3)
+        self.assertIsInstance(r, join.SendMessage)
+        joiner.sent_message(msg, sent_msg1)
+        r = joiner.join([msg])
+        self.assertIsInstance(r, join.EditMessage)
+        first_text = r.text
+
+        # this one doesn't fit anymore
+        r = joiner.join([msg])
+        self.assertIsInstance(r, join.SendMessage)
+        self.assertLessEqual(len(first_text), join.MessageLimit)
+        self.assertLessEqual(len(r.text), join.MessageLimit)
+        joiner.sent_message(msg, sent_msg2)
+
+        r = joiner.join([msg])
+        self.assertIsInstance(r, join.EditMessage)
+        self.assertEqual(r.message_id, sent_msg2.message_id)
+
+    def test_cuts_huge_batch(self):
+        joiner = join.Joiner()
+        msg = SimpleMessage.gen_snapshot()
+        msg.text = "<>" * 2000
+
+        r = joiner.join([msg] * 5)
+        self.assertIsInstance(r, join.SendMessage)
+        self.assertLessEqual(len(r.text), join.MessageLimit)
+
+
+class TestTextBuffer(unittest.TestCase):
+
+    def test_cut_line(self):
+        self.assertEqual(join.cut_line("abc", 3), "abc")
+        self.assertEqual(join.cut_line("abcdef", 4), "abc…")
+        # doesn't leave half of an entity
+        self.assertEqual(join.cut_line("ab&amp;cd", 5), "ab…")
+        # doesn't cut into tags
+        self.assertEqual(join.cut_line("<i>name</i>: text", 14), "<i>name</i>: …")
+        self.assertIsNone(join.cut_line("<i>name</i>: text", 8))
+
+    def test_renders_lines(self):
+        text = join.TextBuffer(["a", "<b>"])
+        text.append("c")
+        self.assertEqual(str(text), "a\n<b>\nc")
+        self.assertEqual(len(text), len(str(text)))
+
+    def test_caches_render(self):
+        text = join.TextBuffer(["a"] * 10)
+        self.assertIs(text.render(), text.render())
+        text.append("b")
+        self.assertTrue(text.render().endswith("\nb"))
+
+    def test_actions_render_latest(self):
+        text = join.TextBuffer(["a"])
+        action = join.EditMessage(1, 2, text)
+        text.append("b")
+        self.assertEqual(action.text, "a\nb")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import join
+from metrics import Metrics, MetricsServer, MetricsDumper
+from pipeline import Pipeline
+from scheduler import ApiScheduler
+from test.fakebot import FakeBot
+from test.pipeline_test import flood, stop
+from test.scheduler_test import FlakyBot
+from deleter import DeletionQueue
+from editor import EditCoalescer
+import unittest
+from typing import *
+
+import os
+import tempfile
+import urllib.request
+
+
+class FailingBot(FakeBot):
+    def delete_message(self, chat_id : int, message_id : int, **kwargs) -> None:
+        raise ValueError("no such message")
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_counter(self):
+        metrics = Metrics()
+        metrics.counter("things_total", "Things", kind="a").inc()
+        metrics.counter("things_total", "Things", kind="a").inc(2)
+        metrics.counter("things_total", "Things", kind="b").inc()
+        text = metrics.render()
+        self.assertIn("# HELP things_total Things\n", text)
+        self.assertIn("# TYPE things_total counter\n", text)
+        self.assertIn('things_total{kind="a"} 3.0\n', text)
+        self.assertIn('things_total{kind="b"} 1.0\n', text)
+
+    def test_histogram(self):
+        metrics = Metrics()
+        histogram = metrics.histogram("wait_seconds", "Waits")
+        for value in (0.003, 0.003, 0.2, 100):
+            histogram.observe(value)
+        text = metrics.render()
+        self.assertIn('wait_seconds_bucket{le="0.001"} 0\n', text)
+        self.assertIn('wait_seconds_bucket{le="0.005"} 2\n', text)
+        self.assertIn('wait_seconds_bucket{le="0.25"} 3\n', text)
+        self.assertIn('wait_seconds_bucket{le="10.0"} 3\n', text)
+        self.assertIn('wait_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn("wait_seconds_count 4\n", text)
+
+    def test_gauge_is_computed_on_render(self):
+        metrics = Metrics()
+        sizes = {"a": 1}
+        metrics.gauge("size", "Size", lambda: {(("name", k),): v for k, v in sizes.items()})
+        self.assertIn('size{name="a"} 1\n', metrics.render())
+        sizes["a"] = 5
+        self.assertIn('size{name="a"} 5\n', metrics.render())
+
+    def test_server_and_dumper(self):
+        metrics = Metrics()
+        metrics.counter("things_total", "Things").inc()
+        server = MetricsServer(metrics, "127.0.0.1", 0)
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            self.assertIn("things_total 1.0", response.read().decode())
+        server.stop()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "joinbot.prom")
+            dumper = MetricsDumper(metrics, path, period=60)
+            dumper.stop()
+            with open(path) as f:
+                self.assertIn("things_total 1.0", f.read())
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_pipeline_counts_decisions(self):
+        metrics = Metrics()
+        bot = FakeBot()
+        pipeline = Pipeline( logic.MessageCounter(), join.Joiner(), bot
+                           , EditCoalescer(bot, interval=0), DeletionQueue(bot, window=0)
+                           , metrics)
+        for msg in flood(-1, logic.MessageThreshold + 2):
+            pipeline.handle(msg)
+        stop(pipeline)
+
+        text = metrics.render()
+        self.assertIn('joinbot_decisions_total{action="DoNothing"} %s.0\n'
+                      % (logic.MessageThreshold - 1), text)
+        self.assertIn('joinbot_decisions_total{action="JoinUserMessages"} 3.0\n', text)
+        self.assertIn("joinbot_decide_seconds_count %s\n"
+                      % (logic.MessageThreshold + 2), text)
+        sizes = pipeline.table_sizes()
+        self.assertEqual(sizes[(("table", "user_bases"),)], 1)
+
+    def test_scheduler_counts_failures(self):
+        metrics = Metrics()
+        api = ApiScheduler(FailingBot(), metrics=metrics)
+        with self.assertRaises(ValueError):
+            api.delete_message(chat_id=-1, message_id=1)
+        api.stop()
+        text = metrics.render()
+        self.assertIn('joinbot_api_failures_total{error="ValueError",method="delete_message"} 1.0'
+                     ,text)
+        self.assertIn('joinbot_api_seconds_count{method="delete_message"} 1', text)
+
+    def test_scheduler_counts_retries(self):
+        metrics = Metrics()
+        api = ApiScheduler(FlakyBot(delay=0.01), metrics=metrics)
+        api.edit_message_text(text="t", chat_id=-1, message_id=1)
+        api.stop()
+        text = metrics.render()
+        self.assertIn('joinbot_api_failures_total{error="RetryAfter",method="edit_message_text"} 1.0'
+                     ,text)
+        self.assertIn('joinbot_api_seconds_count{method="edit_message_text"} 2', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
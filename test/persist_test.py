@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import join
+import persist
+from snapshot import MessageSnapshot, UserRef
+from test.fakebot import FakeBot
+import unittest
+from typing import *
+
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+def fresh_counter() -> logic.MessageCounter:
+    counter = logic.MessageCounter()
+    counter.counters = [logic.UserMessageCounter({}), logic.ContentMessageCounter({})]
+    return counter
+
+def message(chat_id : int, user_id : int, date : datetime, text : str) -> MessageSnapshot:
+    user = UserRef(user_id, f"user {user_id}", None)
+    return MessageSnapshot(chat_id, random.randint(1, 1<<31), user, date, text)
+
+
+class TestPersist(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_continues_flood(self):
+        counter = fresh_counter()
+        joiner = join.Joiner()
+        bot = FakeBot()
+        date = datetime.utcnow()
+
+        for i in range(logic.MessageThreshold):
+            msg = message(-1, 7, date, f"flood {i}")
+            r = counter.decide(msg)
+            date += timedelta(seconds=1)
+        self.assertIsInstance(r, logic.JoinUserMessages)
+        r = joiner.join(r.messages)
+        sent = bot.send_message(-1, r.text)
+        joiner.sent_message(msg, sent)
+
+        live = counter.live_entries()
+        persist.dump_state(counter, joiner, self.path)
+
+        counter = fresh_counter()
+        joiner = join.Joiner()
+        restored = persist.load_state(counter, joiner, self.path, now=date)
+        self.assertEqual(restored, live)
+
+        # the user is still in strict mode, and the same message is edited
+        r = counter.decide(message(-1, 7, date, "more flood"))
+        self.assertIsInstance(r, logic.JoinUserMessages)
+        r = joiner.join(r.messages)
+        self.assertIsInstance(r, join.EditMessage)
+        self.assertEqual(r.message_id, sent.message_id)
+        self.assertTrue(r.text.endswith("flood 4\nmore flood"))
+
+    def test_skips_expired(self):
+        counter = fresh_counter()
+        date = datetime.utcnow()
+        for user in range(10):
+            counter.decide(message(-1, user, date, "hi"))
+        persist.dump_state(counter, join.Joiner(), self.path)
+
+        counter = fresh_counter()
+        later = date + logic.ExpiryHorizon + timedelta(seconds=1)
+        restored = persist.load_state(counter, join.Joiner(), self.path, now=later)
+        self.assertEqual(restored, 0)
+        self.assertEqual(counter.live_entries(), 0)
+
+    def test_rejects_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"garbage")
+        with self.assertRaises(ValueError):
+            persist.load_state(fresh_counter(), join.Joiner(), self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import join
+from pipeline import Pipeline, AsyncPipeline
+from deleter import DeletionQueue
+from editor import EditCoalescer
+from snapshot import MessageSnapshot
+from test.fakebot import FakeBot
+import unittest
+from typing import *
+
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+class User:
+    def __init__(self, id : int) -> None:
+        self.id = id
+        self.full_name = f"user {id}"
+        self.link = f"https://t.me/user{id}"
+
+def flood(chat_id : int, count : int) -> List[MessageSnapshot]:
+    "Messages of one user in quick succession"
+    user = User(random.randint(1, 1<<31))
+    time = datetime.utcnow()
+    result = []
+    for i in range(count):
+        result.append(MessageSnapshot(chat_id, i, user, time, f"message {i}"))
+        time += timedelta(seconds=1)
+    return result
+
+class SlowChatBot(FakeBot):
+    "Takes a long time to send messages to one chat"
+    def __init__(self, slow_chat : int, delay : float) -> None:
+        super().__init__()
+        self.slow_chat = slow_chat
+        self.delay = delay
+        self.sent_chats: List[int] = []
+
+    def send_message(self, chat_id : int, text : str, **kwargs):
+        if chat_id == self.slow_chat:
+            time.sleep(self.delay)
+        self.sent_chats.append(chat_id)
+        return super().send_message(chat_id, text)
+
+
+def make_pipeline(bot) -> Pipeline:
+    return Pipeline( logic.MessageCounter(), join.Joiner(), bot
+                   , EditCoalescer(bot, interval=0), DeletionQueue(bot, window=0))
+
+def stop(pipeline : Pipeline) -> None:
+    pipeline.editor.stop()
+    pipeline.deleter.stop()
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_flood_is_joined(self):
+        bot = FakeBot()
+        pipeline = make_pipeline(bot)
+        messages = flood(-random.randint(1, 1<<31), logic.MessageThreshold + 2)
+        for msg in messages:
+            pipeline.handle(msg)
+        stop(pipeline)
+
+        self.assertEqual(bot.counts["send_message"], 1)
+        self.assertGreaterEqual(bot.counts["edit_message_text"], 1)
+        self.assertEqual(bot.counts["delete_message"], len(messages))
+        # edits may be coalesced, but the latest text is always sent
+        _, (_, _, text) = [c for c in bot.calls if c[0] == "edit_message_text"][-1]
+        self.assertIn(messages[-1].text, text)
+
+    def test_replies_are_united(self):
+        bot = FakeBot()
+        pipeline = make_pipeline(bot)
+        pipeline.counter.counters = [logic.ReplyMessageCounter({})]
+        chat_id = -random.randint(1, 1<<31)
+        date = datetime.utcnow()
+        replies = [MessageSnapshot(chat_id, i, User(i + 1), date, f"agree {i}", 77)
+                   for i in range(logic.MessageThreshold + 1)]
+        for msg in replies:
+            pipeline.handle(msg)
+        stop(pipeline)
+
+        self.assertEqual(bot.counts["send_message"], 1)
+        self.assertEqual(bot.counts["delete_message"], len(replies))
+        _, (_, _, text) = [c for c in bot.calls if c[0] == "edit_message_text"][-1]
+        self.assertIn("user 1", text)
+        self.assertIn(replies[-1].text, text)
+
+
+class TestAsyncPipeline(unittest.TestCase):
+
+    def test_slow_chat_does_not_stall_others(self):
+        slow_chat = -random.randint(1, 1<<31)
+        fast_chat = slow_chat - 1
+        bot = SlowChatBot(slow_chat, delay=0.5)
+        pipeline = make_pipeline(bot)
+
+        async def scenario() -> None:
+            aio = AsyncPipeline(pipeline)
+            for slow, fast in zip(flood(slow_chat, 6), flood(fast_chat, 6)):
+                aio.feed(slow)
+                aio.feed(fast)
+            # the fast chat is done long before the slow one
+            await asyncio.sleep(0.2)
+            self.assertEqual(bot.sent_chats, [fast_chat])
+            await aio.drain()
+            await aio.close()
+
+        asyncio.run(scenario())
+        stop(pipeline)
+        self.assertEqual(bot.sent_chats, [fast_chat, slow_chat])
+        self.assertEqual(bot.counts["delete_message"], 12)
+
+    def test_keeps_order_in_chat(self):
+        bot = FakeBot()
+        pipeline = make_pipeline(bot)
+        messages = flood(-random.randint(1, 1<<31), logic.MessageThreshold + 3)
+
+        async def scenario() -> None:
+            aio = AsyncPipeline(pipeline)
+            for msg in messages:
+                aio.feed(msg)
+            await aio.drain()
+            await aio.close()
+
+        asyncio.run(scenario())
+        stop(pipeline)
+        # the edits came after the message was sent and got its id
+        methods = [method for method, _ in bot.calls if method != "delete_message"]
+        self.assertEqual(methods[0], "send_message")
+        self.assertEqual(set(methods[1:]), {"edit_message_text"})
+
+
+if __name__ == '__main__':
+    unittest.main()
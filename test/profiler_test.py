@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+from profiler import SamplingProfiler, collapse
+import unittest
+from typing import *
+
+import os
+import sys
+import tempfile
+import time
+
+
+def busy(seconds : float) -> int:
+    end = time.monotonic() + seconds
+    spins = 0
+    while time.monotonic() < end:
+        spins += 1
+    return spins
+
+def idle(seconds : float) -> None:
+    time.sleep(seconds)
+
+
+class TestProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "profile.folded")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self) -> Dict[str, int]:
+        stacks = {}
+        with open(self.path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                stacks[stack] = int(count)
+        return stacks
+
+    def test_collapse(self):
+        stack = collapse(sys._getframe())
+        self.assertTrue(stack.split(";")[-1].startswith("test_collapse (profiler_test.py:"))
+        self.assertIn(";", stack)
+
+    def test_samples_wrapped_handler(self):
+        profiler = SamplingProfiler(self.path, interval=0.001)
+        handler = profiler.wrap(busy)
+        profiler.start()
+        handler(0.2)
+        # not wrapped, so not sampled
+        busy(0.1)
+        profiler.stop()
+
+        stacks = self.read()
+        self.assertGreater(sum(stacks.values()), 10)
+        self.assertTrue(all("busy (profiler_test.py" in stack for stack in stacks))
+        self.assertTrue(all("test_samples_wrapped_handler" in stack for stack in stacks))
+
+    def test_off_until_started(self):
+        profiler = SamplingProfiler(self.path, interval=0.001)
+        handler = profiler.wrap(busy)
+        handler(0.05)
+        self.assertEqual(profiler.samples, 0)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_toggle(self):
+        profiler = SamplingProfiler(self.path, interval=0.001, all_threads=True)
+        self.assertTrue(profiler.toggle())
+        idle(0.1)
+        self.assertFalse(profiler.toggle())
+        stacks = self.read()
+        self.assertTrue(any("idle (profiler_test.py" in stack for stack in stacks))
+
+        # every run starts afresh
+        profiler.start()
+        profiler.stop()
+        self.assertLess(sum(self.read().values()), sum(stacks.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import scheduler
+from scheduler import ApiScheduler, TokenBucket
+from test.fakebot import FakeBot, FakeBulkBot
+from telegram.error import RetryAfter # type: ignore
+import unittest
+from typing import *
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+class FlakyBot(FakeBot):
+    "Answers the first edit with RetryAfter"
+    def __init__(self, delay : float) -> None:
+        super().__init__()
+        self.delay = delay
+        self.refused = False
+
+    def edit_message_text(self, text : str, chat_id : int, message_id : int, **kwargs) -> None:
+        if not self.refused:
+            self.refused = True
+            raise RetryAfter(self.delay)
+        super().edit_message_text(text, chat_id, message_id)
+
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, capacity=3, now=0)
+        self.assertTrue(all(bucket.try_take(0) for _ in range(3)))
+        self.assertFalse(bucket.try_take(0))
+        self.assertAlmostEqual(bucket.wait_time(0), 0.5)
+        self.assertTrue(bucket.try_take(0.5))
+
+    def test_block(self):
+        bucket = TokenBucket(rate=1, capacity=5, now=0)
+        bucket.block(3, now=0)
+        self.assertAlmostEqual(bucket.wait_time(0), 3)
+
+
+class TestApiScheduler(unittest.TestCase):
+
+    def test_returns_results(self):
+        bot = FakeBot()
+        api = ApiScheduler(bot)
+        sent = api.send_message(chat_id=-1, text="hi")
+        self.assertEqual(sent.text, "hi")
+        self.assertEqual(bot.calls, [("send_message", (-1, "hi"))])
+        api.stop()
+
+    def test_limits_chat(self):
+        bot = FakeBot()
+        api = ApiScheduler(bot, group_rate=20)
+        start = time.monotonic()
+        with ThreadPoolExecutor(30) as pool:
+            for i in range(30):
+                pool.submit(api.send_message, chat_id=-1, text=str(i))
+        elapsed = time.monotonic() - start
+
+        # 20 go out as a burst and 10 more at 20 per second
+        self.assertEqual(bot.counts["send_message"], 30)
+        self.assertGreater(elapsed, 0.4)
+        api.stop()
+
+    def test_deletes_go_first(self):
+        bot = FakeBot()
+        api = ApiScheduler(bot, global_rate=10)
+        # exhaust the global bucket so that everything queues
+        for _ in range(10):
+            api.global_bucket.try_take(time.monotonic())
+
+        with ThreadPoolExecutor(6) as pool:
+            for i in range(3):
+                pool.submit(api.send_message, chat_id=-1, text=str(i))
+            time.sleep(0.02)
+            for i in range(3):
+                pool.submit(api.delete_message, chat_id=-1, message_id=i)
+
+        methods = [method for method, _ in bot.calls]
+        self.assertEqual(methods[:3], ["delete_message"] * 3)
+        api.stop()
+
+    def test_deletes_not_limited_per_chat(self):
+        bot = FakeBulkBot()
+        api = ApiScheduler(bot, group_rate=0.001, global_rate=1000)
+        for i in range(50):
+            api.delete_message(chat_id=-1, message_id=i)
+        api.delete_messages(-1, [1, 2, 3])
+        self.assertEqual(bot.round_trips(), 51)
+        api.stop()
+
+    def test_retries_after_delay(self):
+        bot = FlakyBot(delay=0.2)
+        api = ApiScheduler(bot)
+        start = time.monotonic()
+        api.edit_message_text(text="t", chat_id=-1, message_id=1)
+        elapsed = time.monotonic() - start
+
+        self.assertEqual(bot.counts["edit_message_text"], 1)
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(api.stats()["retried"], 1)
+        api.stop()
+
+    def test_stats(self):
+        bot = FakeBot()
+        api = ApiScheduler(bot)
+        api.delete_message(chat_id=-1, message_id=1)
+        stats = api.stats()
+        self.assertEqual(stats["done"], 1)
+        self.assertEqual(stats["queued_send"], 0)
+        api.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
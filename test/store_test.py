@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import join
+import store
+from snapshot import MessageSnapshot, UserRef
+from test.fakebot import FakeBot
+import unittest
+from typing import *
+
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+def message(chat_id : int, user_id : int, date : datetime, text : str) -> MessageSnapshot:
+    user = UserRef(user_id, f"user {user_id}", None)
+    return MessageSnapshot(chat_id, random.randint(1, 1<<31), user, date, text)
+
+def run(counter : logic.MessageCounter, joiner : join.Joiner
+       ,messages : List[MessageSnapshot]
+       ) -> List[Tuple[str, Optional[str]]]:
+    "Decide on messages like the pipeline does, return what would be posted"
+    bot = FakeBot()
+    posted = []
+    for msg in messages:
+        decision = counter.decide(msg)
+        if isinstance(decision, logic.DoNothing):
+            joiner.cleanup(msg)
+            posted.append(("nothing", None))
+            continue
+        elif isinstance(decision, logic.UniteMessagesContent):
+            action = joiner.unite_content(decision.messages)
+        else:
+            action = joiner.join(decision.messages)
+        posted.append((type(action).__name__, action.text))
+        if isinstance(action, join.SendMessage):
+            joiner.sent_message(msg, bot.send_message(msg.chat_id, action.text))
+    return posted
+
+def traffic(count : int) -> List[MessageSnapshot]:
+    random.seed(1)
+    date = datetime.utcnow()
+    messages = []
+    for i in range(count):
+        user = random.choice([1, 2, 3, 3, 3, 3])
+        text = random.choice(["hi", "spam", f"text {i}"])
+        messages.append(message(-1, user, date, text))
+        date += timedelta(seconds=random.choice([0, 1, 1, 2, 5]))
+    return messages
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_same_decisions(self):
+        messages = traffic(300)
+        memory = store.MemoryStore()
+        expected = run(store.make_counter(memory), store.make_joiner(memory), messages)
+        sqlite = store.SqliteStore(self.path, batch=7)
+        actual = run(store.make_counter(sqlite), store.make_joiner(sqlite), messages)
+        sqlite.close()
+        self.assertEqual(actual, expected)
+        self.assertTrue(any(kind == "EditMessage" for kind, _ in expected))
+
+    def test_shared_after_flush(self):
+        first = store.SqliteStore(self.path, batch=1000, interval=60)
+        second = store.SqliteStore(self.path)
+        table_a = first.table("t", join.UID, store.InfoCodec)
+        table_b = second.table("t", join.UID, store.InfoCodec)
+        key = join.UID(-1, 7)
+
+        table_a[key] = join.MessageInfo(10, join.TextBuffer(["a"]))
+        table_a[key] = join.MessageInfo(10, join.TextBuffer(["a", "b"]))
+        self.assertIn(key, table_a)
+        self.assertNotIn(key, table_b)
+
+        first.flush()
+        self.assertEqual(list(table_b), [key])
+        info = table_b[key]
+        self.assertEqual(info.message_id, 10)
+        self.assertEqual(str(info.text), "a\nb")
+        # both changes went in one commit
+        self.assertEqual(first.commits, 1)
+
+        del table_b[key]
+        self.assertNotIn(key, table_b)
+        second.flush()
+        self.assertNotIn(key, table_a)
+        self.assertEqual(len(table_a), 0)
+        first.close()
+        second.close()
+
+    def test_purges_left_behind(self):
+        date = datetime.utcnow() - store.Retention - timedelta(minutes=1)
+        sqlite = store.SqliteStore(self.path, interval=60)
+        counter = store.make_counter(sqlite)
+        for user in range(1, 11):
+            counter.decide(message(-1, user, date, f"hi {user}"))
+        # the counter has seen no later messages to evict these with
+        self.assertEqual(sum(map(lambda c: len(c.msg_queue.pending), counter.counters)), 20)
+        sqlite.flush()
+        self.assertEqual(counter.live_entries(), 0)
+        sqlite.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import join
+from deleter import DeletionQueue
+from editor import EditCoalescer
+from pipeline import Pipeline, AsyncPipeline
+from snapshot import MessageSnapshot
+from webhook import WebhookServer
+from test.fakebot import FakeBot
+from bench.traffic import make_update
+import unittest
+from typing import *
+
+import asyncio
+import json
+import random
+import time
+
+async def post(port : int, path : str, bodies : List[bytes]) -> List[bytes]:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    statuses = []
+    for body in bodies:
+        writer.write(f"POST {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+        statuses.append((await reader.readline()).split()[1])
+        while (await reader.readline()) != b"\r\n":
+            pass
+    writer.close()
+    return statuses
+
+
+class TestSnapshotJson(unittest.TestCase):
+
+    def test_parses_fields(self):
+        update = make_update(1, 42, -100, 7, time.time(), "hello")
+        update["message"]["reply_to_message"] = {"message_id": 41}
+        update["message"]["from"]["last_name"] = "Smith"
+        message = MessageSnapshot.from_json(update["message"])
+
+        self.assertEqual(message.chat_id, -100)
+        self.assertEqual(message.message_id, 42)
+        self.assertEqual(message.from_id, 7)
+        self.assertEqual(message.text, "hello")
+        self.assertEqual(message.reply_to_id, 41)
+        self.assertFalse(message.forwarded)
+        self.assertEqual(message.user.full_name, "User7 Smith")
+        self.assertEqual(message.user.link, "https://t.me/user7")
+
+    def test_forwarded(self):
+        update = make_update(1, 42, -100, 7, time.time(), "hello")
+        update["message"]["forward_date"] = int(time.time())
+        self.assertTrue(MessageSnapshot.from_json(update["message"]).forwarded)
+
+
+class TestWebhookServer(unittest.TestCase):
+
+    def test_flood_over_http(self):
+        bot = FakeBot()
+        deleter = DeletionQueue(bot, window=0)
+        editor = EditCoalescer(bot, interval=0)
+        chat_id = -random.randint(1, 1<<31)
+        now = time.time()
+        updates = [make_update(i, i, chat_id, 7, now + i, f"spam {i}")
+                   for i in range(logic.MessageThreshold)]
+
+        async def scenario() -> Tuple[List[bytes], WebhookServer]:
+            pipeline = AsyncPipeline(Pipeline(logic.MessageCounter(), join.Joiner()
+                                             , bot, editor, deleter))
+            server = WebhookServer(pipeline, "/secret")
+            await server.start("127.0.0.1", 0)
+            port = server.server.sockets[0].getsockname()[1]
+
+            bodies = [json.dumps(u).encode() for u in updates]
+            bodies.append(b"not json")
+            statuses = await post(port, "/secret", bodies)
+            statuses += await post(port, "/wrong", [bodies[0]])
+
+            await pipeline.drain()
+            await server.stop()
+            await pipeline.close()
+            return statuses, server
+
+        statuses, server = asyncio.run(scenario())
+        editor.stop()
+        deleter.stop()
+
+        self.assertEqual(statuses, [b"200"] * len(updates) + [b"400", b"404"])
+        self.assertEqual(server.received, len(updates))
+        self.assertEqual(server.malformed, 1)
+        self.assertEqual(bot.counts["send_message"], 1)
+        self.assertEqual(bot.counts["delete_message"], len(updates))
+
+
+if __name__ == '__main__':
+    unittest.main()
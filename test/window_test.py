@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+from window import RingWindow
+import unittest
+from typing import *
+
+import random
+from datetime import datetime, timedelta
+
+class Dated:
+    def __init__(self, date : datetime, name : int) -> None:
+        self.date = date
+        self.name = name
+
+
+class TestRingWindow(unittest.TestCase):
+
+    def test_keeps_order(self):
+        base = datetime.utcnow()
+        window = RingWindow(8)
+        for s in [0, 1, 3, 2, 5, 4]:
+            window.insert(Dated(base + timedelta(seconds=s), s))
+
+        self.assertEqual([x.name for x in window], [0, 1, 2, 3, 4, 5])
+        self.assertEqual(window.latest(), base + timedelta(seconds=5))
+        self.assertEqual(window[0].name, 0)
+        self.assertEqual(window[-1].name, 5)
+
+    def test_equal_dates_keep_arrival(self):
+        base = datetime.utcnow()
+        window = RingWindow(4)
+        for i in range(3):
+            window.insert(Dated(base, i))
+        self.assertEqual([x.name for x in window], [0, 1, 2])
+
+    def test_drops_old(self):
+        base = datetime.utcnow()
+        window = RingWindow(4)
+        # wraps around the ring a couple of times
+        for s in range(10):
+            window.insert(Dated(base + timedelta(seconds=s), s))
+            window.drop_until(base + timedelta(seconds=s - 2))
+            self.assertLessEqual(len(window), 2)
+        self.assertEqual([x.name for x in window], [8, 9])
+
+        window.drop_until(base + timedelta(seconds=100))
+        self.assertEqual(len(window), 0)
+        self.assertEqual(list(window), [])
+
+    def test_overflow_drops_oldest(self):
+        base = datetime.utcnow()
+        window = RingWindow(3)
+        for s in range(5):
+            window.insert(Dated(base + timedelta(seconds=s), s))
+        self.assertEqual([x.name for x in window], [2, 3, 4])
+
+    def test_matches_sorted(self):
+        base = datetime.utcnow()
+        window = RingWindow(16)
+        reference: List[Dated] = []
+        for i in range(1000):
+            item = Dated(base + timedelta(seconds=i + random.randint(-3, 0)), i)
+            window.insert(item)
+            reference.append(item)
+            reference.sort(key=lambda x: x.date)
+            threshold = window.latest() - timedelta(seconds=5)
+            window.drop_until(threshold)
+            reference = [x for x in reference if x.date > threshold][-16:]
+
+            self.assertEqual([x.date for x in window]
+                            ,[x.date for x in reference])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+"""
+
+import logic
+import store
+import workers
+from snapshot import MessageSnapshot, UserRef
+import unittest
+from typing import *
+
+import multiprocessing
+import os
+import tempfile
+from functools import partial
+from datetime import datetime, timedelta
+
+def recording_handler(results : multiprocessing.Queue, store_path : str
+                     ,index : int, count : int
+                     ) -> workers.Handler:
+    "Decide with state in the store and report what was decided by whom"
+    state = store.SqliteStore(store_path)
+    counter = store.make_counter(state)
+    def handle(message : MessageSnapshot) -> None:
+        decision = counter.decide(message)
+        results.put((index, message.chat_id, message.message_id, type(decision).__name__))
+    return handle, state.close
+
+def run_pool(count : int, store_path : str, messages : List[MessageSnapshot]
+            ) -> List[Tuple[int, int, int, str]]:
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    pool = workers.WorkerPool(count, partial(recording_handler, results, store_path), batch=5)
+    for msg in messages:
+        pool.feed(msg)
+    pool.stop()
+    return [results.get() for _ in messages]
+
+def flood(chats : List[int], amount : int, date : datetime) -> List[MessageSnapshot]:
+    messages = []
+    for i in range(amount):
+        for chat_id in chats:
+            user = UserRef(1, "flooder", None)
+            messages.append(MessageSnapshot(chat_id, i + 1, user, date, f"flood {i}"))
+        date += timedelta(seconds=1)
+    return messages
+
+
+class TestWorkers(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp()
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def test_chat_order(self):
+        chats = list(range(-20, 0))
+        messages = flood(chats, 8, datetime.utcnow())
+        results = run_pool(3, self.path, messages)
+
+        owners: Dict[int, Set[int]] = {}
+        handled: Dict[int, List[int]] = {}
+        for index, chat_id, message_id, _ in results:
+            owners.setdefault(chat_id, set()).add(index)
+            handled.setdefault(chat_id, []).append(message_id)
+        for chat_id in chats:
+            self.assertEqual(owners[chat_id], {workers.shard_of(chat_id, 3)})
+            self.assertEqual(handled[chat_id], list(range(1, 9)))
+        # every flood got joined, at the same message
+        joined = [r for r in results if r[3] == "JoinUserMessages"]
+        self.assertEqual(len(joined), len(chats) * (8 - logic.MessageThreshold + 1))
+
+    def test_reshard(self):
+        chats = list(range(-12, 0))
+        date = datetime.utcnow()
+        first = flood(chats, logic.MessageThreshold - 1, date)
+        results = run_pool(2, self.path, first)
+        self.assertTrue(all(r[3] == "DoNothing" for r in results))
+
+        # restarted with more workers, the floods continue where they were
+        later = date + timedelta(seconds=logic.MessageThreshold)
+        second = [MessageSnapshot(chat_id, 100, UserRef(1, "flooder", None), later, "more")
+                  for chat_id in chats]
+        results = run_pool(3, self.path, second)
+        moved = [chat_id for chat_id in chats
+                 if workers.shard_of(chat_id, 2) != workers.shard_of(chat_id, 3)]
+        self.assertTrue(moved)
+        self.assertTrue(all(r[3] == "JoinUserMessages" for r in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
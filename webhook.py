@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: receiving updates with a webhook instead of long polling.
+Telegram posts every update as json to a url you give it. This runs a small
+http server on asyncio that takes the messages straight out of the json into
+snapshots, without building full telegram objects, and feeds them into an
+AsyncPipeline.
+
+Telegram only posts to https, so put this behind a reverse proxy that
+terminates tls and forwards to the local port.
+
+Usage: python3 webhook.py https://your.domain/secret-path [--port 8080]
+The path of the url is the path the server accepts updates on.
+Press Ctrl-C on the command line or send SIGTERM to the process to stop the
+bot. SIGUSR2 starts or stops the sampling profiler, which here samples all
+threads, since updates are handled by tasks and not by a handler call.
+"""
+
+from typing import *
+from functools import partial
+from urllib.parse import urlparse
+import argparse
+import asyncio
+import json
+import signal
+import logging
+from main import make_pipeline
+from async_main import Commands
+from pipeline import AsyncPipeline
+from snapshot import MessageSnapshot
+from metrics import Metrics, MetricsServer
+from profiler import SamplingProfiler
+from telegram import Bot # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# refuse bodies larger than this, telegram updates are much smaller
+MaxBody = 1 << 20
+
+Responses = { 200: b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n"
+            , 400: b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n"
+            , 404: b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+            , 413: b"HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+            }
+
+
+class WebhookServer:
+    "Accepts update json over http and feeds it to a pipeline"
+
+    def __init__(self, pipeline : AsyncPipeline, path : str) -> None:
+        self.pipeline = pipeline
+        self.path = path
+        self.server: Optional[asyncio.AbstractServer] = None
+
+        # statistics
+        self.received = 0
+        self.ignored = 0
+        self.malformed = 0
+
+    async def start(self, host : str, port : int) -> None:
+        self.server = await asyncio.start_server(self.serve_client, host, port)
+
+    async def stop(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def serve_client(self, reader : asyncio.StreamReader
+                                , writer : asyncio.StreamWriter
+                          ) -> None:
+        try:
+            # connections are kept alive, telegram reuses them
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                parts = request.split()
+                headers = await self.read_headers(reader)
+                length = int(headers.get(b"content-length", b"0"))
+                if length > MaxBody:
+                    writer.write(Responses[413])
+                    await writer.drain()
+                    break
+                body = await reader.readexactly(length)
+
+                if len(parts) < 2 or parts[0] != b"POST" or parts[1].decode() != self.path:
+                    status = 404
+                else:
+                    status = self.ingest(body)
+                writer.write(Responses[status])
+                await writer.drain()
+                if headers.get(b"connection", b"").lower() == b"close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_headers(self, reader : asyncio.StreamReader) -> Dict[bytes, bytes]:
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                return headers
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+
+    def ingest(self, body : bytes) -> int:
+        "Queue the message of an update. Returns http status"
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self.malformed += 1
+            return 400
+        self.received += 1
+
+        data = update.get("message")
+        if data is None or not data.get("text") or "from" not in data:
+            self.ignored += 1
+            return 200
+        try:
+            message = MessageSnapshot.from_json(data)
+        except (KeyError, TypeError):
+            self.malformed += 1
+            return 400
+
+        if message.text.startswith("/"):
+            self.command(message)
+        else:
+            self.pipeline.feed(message)
+        return 200
+
+    def command(self, message : MessageSnapshot) -> None:
+        command = message.text.split()[0].split("@")[0]
+        if command not in Commands:
+            return
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(self.pipeline.executor, partial(
+                self.pipeline.pipeline.api.send_message
+                ,chat_id = message.chat_id
+                ,text    = Commands[command]
+                ))
+
+
+async def run(token : str, url : str, host : str, port : int
+             ,store_path : Optional[str] = None
+             ,metrics_port : Optional[int] = None
+             ) -> None:
+    bot = Bot(token)
+    metrics = None if metrics_port is None else Metrics()
+    sync_pipeline, stop_pipeline = make_pipeline(bot, store_path, metrics=metrics)
+    pipeline = AsyncPipeline(sync_pipeline)
+
+    server = WebhookServer(pipeline, urlparse(url).path or "/")
+    await server.start(host, port)
+    bot.set_webhook(url)
+    logger.info("Listening for updates on %s:%s", host, port)
+    metrics_server = None
+    if metrics is not None:
+        metrics_server = MetricsServer(metrics, host, metrics_port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    profiler = SamplingProfiler(all_threads=True)
+    loop.add_signal_handler(signal.SIGUSR2, profiler.toggle)
+    await stop.wait()
+    profiler.stop()
+
+    bot.delete_webhook()
+    await server.stop()
+    await pipeline.drain()
+    await pipeline.close()
+    stop_pipeline()
+    if metrics_server is not None:
+        metrics_server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot with a webhook")
+    parser.add_argument("url", help="public https url telegram posts updates to")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--store", help="keep the state in a sqlite database at this path")
+    parser.add_argument("--metrics-port", type=int
+                       ,help="serve prometheus metrics on /metrics of this port")
+    args = parser.parse_args()
+
+    with open("token.txt", "r") as tfile:
+        token = tfile.read().strip()
+    asyncio.run(run(token, args.url, args.host, args.port, args.store
+                    ,args.metrics_port))
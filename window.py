@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+from typing import *
+from datetime import datetime
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: a sliding window of recent messages for the counters. Messages
+are kept ordered by their date in a ring buffer of fixed capacity. Telegram
+dates almost always arrive in order, so inserting is appending to the end,
+and dropping old messages is moving the start. Both are O(1), and so is
+getting the latest date. When a message arrives out of order, it's moved back
+to its place like in insertion sort, which only costs as much as the amount of
+messages it has to jump over.
+
+Any item with a `date` attribute can be stored.
+"""
+
+
+class RingWindow:
+    "Items ordered by date in a fixed-size ring buffer"
+    __slots__ = ("items", "start", "count")
+
+    def __init__(self, capacity : int, initial : Iterable = ()) -> None:
+        self.items: List[Any] = [None] * capacity
+        self.start = 0
+        self.count = 0
+        for item in initial:
+            self.insert(item)
+
+    def insert(self, item) -> None:
+        "Insert an item after all items with the same or earlier date"
+        items = self.items
+        capacity = len(items)
+        if self.count == capacity:
+            # no space left, forget the oldest one
+            self.drop_first()
+
+        pos = (self.start + self.count) % capacity
+        self.count += 1
+        date = item.date
+        # out of order fallback: shift later items one place forward
+        while pos != self.start:
+            prev = (pos - 1) % capacity
+            if items[prev].date <= date:
+                break
+            items[pos] = items[prev]
+            pos = prev
+        items[pos] = item
+
+    def drop_first(self) -> None:
+        self.items[self.start] = None
+        self.start = (self.start + 1) % len(self.items)
+        self.count -= 1
+
+    def drop_until(self, time : datetime) -> None:
+        "Drop all items with date earlier or equal to time"
+        items = self.items
+        while self.count > 0 and items[self.start].date <= time:
+            self.drop_first()
+
+    def latest(self) -> datetime:
+        return self.items[(self.start + self.count - 1) % len(self.items)].date
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i : int):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("RingWindow index out of range")
+        return self.items[(self.start + i) % len(self.items)]
+
+    def to_list(self) -> list:
+        "Items in order, faster than iterating"
+        end = self.start + self.count
+        if end <= len(self.items):
+            return self.items[self.start : end]
+        return self.items[self.start :] + self.items[: end - len(self.items)]
+
+    def __iter__(self) -> Iterator:
+        items = self.items
+        capacity = len(items)
+        for i in range(self.count):
+            yield items[(self.start + i) % capacity]
+
+    def __repr__(self) -> str:
+        return f"RingWindow({list(self)!r})"
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+Author: d86leader@mail.com, 2019
+License: published under GNU GPL-3
+
+Description: running the bot on several cores. The front process polls for
+updates and routes every message by its chat id to one of N worker
+processes. Each worker has its own pipeline with its own counters and joiner,
+so all messages of a chat are decided by the same worker, in the order they
+arrived.
+
+Workers keep their state in one sqlite database they share (see store.py).
+State is keyed by chat, so when the bot is restarted with another amount of
+workers, a chat that moved to another worker finds its state there. Every
+worker gets an equal share of the global bot api rate limit, and limits of
+a chat are kept by the worker that owns it.
+
+Usage: python3 workers.py [--workers 4] [--store state.db]
+Press Ctrl-C on the command line or send SIGTERM to the process to stop the
+bot.
+"""
+
+from typing import *
+from functools import partial
+import argparse
+import logging
+import multiprocessing
+import signal
+import threading
+from main import make_pipeline
+from async_main import Commands, PollTimeout
+from snapshot import MessageSnapshot
+from telegram import Bot, Update # type: ignore
+from telegram.error import TelegramError # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# returns how to handle a message and what to call when the worker stops
+Handler = Tuple[Callable[[MessageSnapshot], None], Callable[[], None]]
+HandlerFactory = Callable[[int, int], Handler]
+
+
+def shard_of(chat_id : int, shards : int) -> int:
+    "Which worker owns the chat. Doesn't change between runs"
+    return chat_id % shards
+
+
+def worker_main(index : int, count : int
+               ,queue : multiprocessing.Queue
+               ,make_handler : HandlerFactory
+               ) -> None:
+    # the front process tells when to stop, after sending everything
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    handle, stop = make_handler(index, count)
+    try:
+        while True:
+            batch = queue.get()
+            if batch is None:
+                break
+            for message in batch:
+                try:
+                    handle(message)
+                except Exception:
+                    logger.exception("Failed to handle message in chat %s", message.chat_id)
+    finally:
+        stop()
+
+
+class WorkerPool:
+    "Worker processes with messages routed to them by chat"
+
+    def __init__(self, workers : int
+                     , make_handler : HandlerFactory
+                     , batch : int = 64
+                ) -> None:
+        # messages are sent to workers in lists, one at a time costs too much
+        self.batch = batch
+        self.queues: List[multiprocessing.Queue] = []
+        self.processes: List[multiprocessing.Process] = []
+        self.buffers: List[List[MessageSnapshot]] = [[] for _ in range(workers)]
+        for index in range(workers):
+            queue: multiprocessing.Queue = multiprocessing.Queue()
+            process = multiprocessing.Process(
+                    target=worker_main
+                    ,args=(index, workers, queue, make_handler)
+                    ,name=f"worker-{index}"
+                    )
+            process.start()
+            self.queues.append(queue)
+            self.processes.append(process)
+
+    def feed(self, message : MessageSnapshot) -> None:
+        "Queue a message for its worker. Call flush() to be sure it's sent"
+        index = shard_of(message.chat_id, len(self.queues))
+        buffer = self.buffers[index]
+        buffer.append(message)
+        if len(buffer) >= self.batch:
+            self.queues[index].put(buffer)
+            self.buffers[index] = []
+
+    def flush(self) -> None:
+        for index, buffer in enumerate(self.buffers):
+            if buffer:
+                self.queues[index].put(buffer)
+                self.buffers[index] = []
+
+    def stop(self) -> None:
+        "Let workers handle everything sent to them and wait for them"
+        self.flush()
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join()
+
+
+def bot_handler(token : str, store_path : str, index : int, count : int) -> Handler:
+    "A pipeline of a worker, built in the worker process"
+    pipeline, stop = make_pipeline(Bot(token), store_path, api_share=1 / count)
+    return pipeline.handle, stop
+
+
+def route(update : Update, bot : Bot, pool : WorkerPool) -> None:
+    "Answer a command or send a message to its worker"
+    message = update.message
+    if message is None or not message.text:
+        return
+    if message.text.startswith("/"):
+        command = message.text.split()[0].split("@")[0]
+        if command in Commands:
+            bot.send_message(chat_id=message.chat.id, text=Commands[command])
+        return
+    pool.feed(MessageSnapshot.of(message))
+
+
+def run(token : str, workers : int, store_path : str) -> None:
+    bot = Bot(token)
+    pool = WorkerPool(workers, partial(bot_handler, token, store_path))
+
+    stopped = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopped.set())
+
+    offset = None
+    while not stopped.is_set():
+        try:
+            updates = bot.get_updates(offset=offset, timeout=PollTimeout)
+        except TelegramError as e:
+            logger.warning("Polling failed: %s", e)
+            stopped.wait(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            route(update, bot, pool)
+        pool.flush()
+    pool.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bot on several processes")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--store", default="state.db", help="sqlite database the workers share")
+    args = parser.parse_args()
+
+    with open("token.txt", "r") as tfile:
+        token = tfile.read().strip()
+    run(token, args.workers, args.store)